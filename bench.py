@@ -0,0 +1,189 @@
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'day9'))
+
+import main as day9
+import compiler
+import batch
+import profiler
+import analysis
+
+
+def load(day):
+    spec = importlib.util.spec_from_file_location(day + '_main', os.path.join(ROOT, day, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+day5 = load('day5')
+day7 = load('day7')
+
+
+def read_program(day):
+    with open(os.path.join(ROOT, day, 'input')) as f:
+        return [int(x) for x in f.read().strip().split(',')]
+
+
+def count_down(n):
+    # Decrements its input to zero, then prints it
+    return [3,20,1001,20,-1,20,1005,20,2,4,20,99] + [0] * 9, [n]
+
+def self_modifying(n):
+    # Sums 0..n-1 by bumping the immediate operand of its own add instruction
+    return [3,20,1001,21,0,21,1001,4,1,4,1001,20,-1,20,1005,20,2,4,21,99,0,0], [n]
+
+def recursion(n):
+    # Sums 1..n with a recursive function, keeping its frames on a relative base stack
+    return [
+        109,1000,203,1,21101,13,0,0,109,2,1105,1,16,204,1,99,
+        1205,-1,26,21101,0,0,-1,1105,1,43,
+        21101,39,0,0,21201,-1,-1,1,109,2,1105,1,16,
+        22201,-1,1,-1,109,-2,2106,0,0
+    ], [n]
+
+
+# name -> (program, input, needs relative base and memory past the program)
+CORPUS = {
+    'quine': ([109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99], [], True),
+    'big_number': ([1102,34915192,34915192,7,4,7,99,0], [], False),
+    'big_number_in_the_middle': ([104,1125899906842624,99], [], False),
+    'day5': (read_program('day5'), [5], False),
+    'day7_amplifier': (read_program('day7'), [0, 4], False),
+    'day9_part1': (read_program('day9'), [1], True),
+    'day9_part2': (read_program('day9'), [2], True),
+    'count_down': (*count_down(30000), False),
+    'self_modifying': (*self_modifying(20000), False),
+    'recursion': (*recursion(5000), True),
+}
+
+
+class BatchOfOne():
+    def __init__(self, program):
+        self.batch = batch.BatchIntcode(program, 1)
+
+    def run(self, input):
+        return self.batch.run([input])
+
+    def get_output(self):
+        return self.batch.get_outputs()[0]
+
+
+# name -> (machine factory, supports relative base and memory past the program)
+ENGINES = {
+    'day5.Jumper': (day5.Jumper, False),
+    'day7.Jumper': (day7.Jumper, False),
+    'day9.IntcodeV3': (day9.IntcodeV3, True),
+    'day9.CompiledIntcodeV3': (compiler.CompiledIntcodeV3, True),
+    'day9.BatchIntcode': (BatchOfOne, True),
+    'day9.OptimizedIntcodeV3': (analysis.OptimizedIntcodeV3, True),
+}
+
+
+def instruction_count(program, input):
+    computer = day9.IntcodeV3(program[:])
+    profile = profiler.Profiler(computer)
+    computer.run(input[:])
+    return sum(profile.sites.values())
+
+
+def measure(engine, program, input):
+    start = time.perf_counter()
+    computer = engine(program[:])
+    startup = time.perf_counter() - start
+    computer.run(input[:])
+    elapsed = time.perf_counter() - start - startup
+    tracemalloc.start()
+    engine(program[:]).run(input[:])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return computer.get_output(), startup, elapsed, peak
+
+
+def bench(engines, programs):
+    results = {}
+    failures = []
+    for name in programs:
+        program, input, extended = CORPUS[name]
+        # `run` pops input from the end
+        input = input[::-1]
+        instructions = instruction_count(program, input)
+        outputs = {}
+        for engine_name in engines:
+            engine, supports_extended = ENGINES[engine_name]
+            if extended and not supports_extended:
+                continue
+            output, startup, elapsed, peak = measure(engine, program, input)
+            outputs[engine_name] = output
+            results.setdefault(engine_name, {})[name] = {
+                'instructions_per_second': instructions / elapsed if elapsed else float('inf'),
+                'startup': startup,
+                'peak_memory': peak,
+            }
+            print("{:<24} {:<26} {:>12.0f} instr/s {:>9.2f} ms startup {:>9} B peak".format(
+                engine_name, name, instructions / elapsed if elapsed else float('inf'),
+                startup * 1000, peak
+            ))
+        if len(set(map(repr, outputs.values()))) > 1:
+            failures.append("{}: engines disagree: {}".format(name, outputs))
+    return results, failures
+
+
+def regressions(results, baseline, tolerance):
+    for engine, programs in baseline.items():
+        for name, expected in programs.items():
+            actual = results.get(engine, {}).get(name)
+            if actual is None:
+                continue
+            limit = expected['instructions_per_second'] * (1 - tolerance)
+            if actual['instructions_per_second'] < limit:
+                yield "{} on {}: {:.0f} instr/s, baseline {:.0f}".format(
+                    engine, name, actual['instructions_per_second'], expected['instructions_per_second']
+                )
+
+
+def scaling(name, copies, worker_counts):
+    # Same program on `copies` machines, on thread pools of growing size
+    program, input, _ = CORPUS[name]
+    input = input[::-1]
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print("{} copies of {}, GIL {}, {} cores".format(copies, name, "enabled" if gil else "disabled", os.cpu_count()))
+    first = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        day9.run_many(program, [input[:] for _ in range(copies)], workers)
+        elapsed = time.perf_counter() - start
+        first = first or elapsed
+        print("{:>4} threads {:>9.3f} s {:>6.2f}x".format(workers, elapsed, first / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and cross-check the Intcode interpreters")
+    parser.add_argument('--engine', action='append', choices=list(ENGINES), help="engines to run, all by default")
+    parser.add_argument('--program', action='append', choices=list(CORPUS), help="programs to run, all by default")
+    parser.add_argument('--baseline', default=os.path.join(ROOT, 'bench_baseline.json'))
+    parser.add_argument('--save', action='store_true', help="save results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument('--scaling', type=int, metavar='COPIES', help="measure thread pool scaling instead")
+    args = parser.parse_args()
+
+    if args.scaling:
+        for name in args.program or ['day9_part2']:
+            scaling(name, args.scaling, [1, 2, 4, 8])
+        sys.exit(0)
+    results, failures = bench(args.engine or list(ENGINES), args.program or list(CORPUS))
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            failures.extend(regressions(results, json.load(f), args.tolerance))
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
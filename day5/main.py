@@ -1,3 +1,15 @@
+OPERANDS = {
+    1: 3,
+    2: 3,
+    3: 1,
+    4: 1,
+    5: 2,
+    6: 2,
+    7: 3,
+    8: 3,
+    99: 0,
+}
+
 class Intcode():
     def __init__(self, memory):
         self.memory = memory
@@ -11,6 +23,8 @@ class Intcode():
             4: self.output_instruction,
             99: self.exit_instruction
         }
+        # address -> (op, handler, modes, operands count)
+        self._decoded = {}
         super().__init__()
 
     def run(self, input=None):
@@ -30,6 +44,9 @@ class Intcode():
 
     def set_memory(self, pos, val):
         self.memory[pos] = val
+        if pos in self._decoded:
+            # Self-modifying code rewrote an instruction we've already decoded
+            del self._decoded[pos]
 
     def get(self, position):
         return self.memory[position]
@@ -40,44 +57,52 @@ class Intcode():
         return val
 
     def pop_instruction(self):
-        instruction = self.pop()
+        address = self.cursor
+        decoded = self._decoded.get(address)
+        if decoded is None:
+            decoded = self.decode(self.pop())
+            self._decoded[address] = decoded
+        else:
+            self.cursor += 1
+        return decoded
+
+    def decode(self, instruction):
         encoded_modes, op = divmod(instruction, 100)
-        modes = {i: int(x) for i, x in enumerate(reversed(str(encoded_modes)))}
-        return op, modes
+        handler = self.instructions.get(op)
+        if handler is None:
+            raise Exception("Unknown instruction: {}".format(op))
+        modes = (encoded_modes % 10, encoded_modes // 10 % 10, encoded_modes // 100 % 10)
+        return op, handler, modes, OPERANDS[op]
 
     def tick(self):
-        instruction, modes = self.pop_instruction()
-        handler = self.instructions.get(instruction)
-        if handler is not None:
-            return handler(modes)
-        else:
-            raise Exception("Unknown instruction: {}".format(instruction))
+        _, handler, modes, _ = self.pop_instruction()
+        return handler(modes)
 
     def sum_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, left + right)
         return False
 
     def multiplication_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, left * right)
         return False
 
     def input_instruction(self, modes):
         output_position = self.pop()
-        assert modes.pop(0, 0) == 0, "Immediate mode for output?"
+        assert modes[0] == 0, "Immediate mode for output?"
         val = self.pop_input()
         self.set_memory(output_position, val)
         return False
 
     def output_instruction(self, modes):
-        val = self.get_arg(self.pop(), modes.pop(0, 0))
+        val = self.get_arg(self.pop(), modes[0])
         self.output(val)
         return False
 
@@ -108,30 +133,30 @@ class Jumper(Intcode):
         self.cursor = pointer
 
     def jump_if_true_instruction(self, modes):
-        condition = self.get_arg(self.pop(), modes.pop(0, 0))
-        pointer = self.get_arg(self.pop(), modes.pop(1, 0))
+        condition = self.get_arg(self.pop(), modes[0])
+        pointer = self.get_arg(self.pop(), modes[1])
         if condition != 0:
             self.set_cursor(pointer)
 
     def jump_if_false_instruction(self, modes):
-        condition = self.get_arg(self.pop(), modes.pop(0, 0))
-        pointer = self.get_arg(self.pop(), modes.pop(1, 0))
+        condition = self.get_arg(self.pop(), modes[0])
+        pointer = self.get_arg(self.pop(), modes[1])
         if condition == 0:
             self.set_cursor(pointer)
 
     def less_then_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, int(left < right))
         return False
 
     def equals_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, int(left == right))
         return False
 
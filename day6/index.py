@@ -0,0 +1,185 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from main import Map
+
+# Orbit index layout, all little-endian:
+#   header: magic, version, SHA-256, size and mtime of the source file, number
+#     of bodies, number of lifting table levels, number of hash table slots,
+#     total orbit count, length of the name blob
+#   int32 arrays: parents, depths, subtree sizes, lifting table levels above
+#     the parents, child offsets and children in CSR layout, and the hash
+#     table of names, open addressing on the CRC32 of the name, -1 if empty
+#   padding to 8 bytes, then int64 offsets of names in the blob, and the blob
+#     of UTF-8 names
+MAGIC = b'OMI\0'
+VERSION = 1
+HEADER = struct.Struct('<4sI32sQQQIIqQ')
+# Size and mtime of the source, within the header
+STAMP = struct.Struct('<QQ')
+STAMP_OFFSET = struct.calcsize('<4sI32s')
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def source_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write(orbit_map, path, source):
+    # `source` is the path of the file `orbit_map` was loaded from
+    bodies = len(orbit_map._names)
+    orbit_map.ancestors()
+    offsets = array('i', [0])
+    children = array('i')
+    for i in range(bodies):
+        children.extend(orbit_map.children(i))
+        offsets.append(len(children))
+    encoded = [name.encode() for name in orbit_map._names]
+    slots = 1
+    while slots < 2 * bodies:
+        slots *= 2
+    table = array('i', [-1]) * slots
+    for i, name in enumerate(encoded):
+        slot = zlib.crc32(name) & (slots - 1)
+        while table[slot] >= 0:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i
+    name_offsets = array('q', [0])
+    for name in encoded:
+        name_offsets.append(name_offsets[-1] + len(name))
+    levels = orbit_map.ancestors()[1:]
+    size, mtime = source_stamp(source)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, source_hash(source), size, mtime, bodies, len(levels), slots,
+            orbit_map.orbit_count(), name_offsets[-1]
+        ))
+        for values in (orbit_map._parents, orbit_map._depths, orbit_map._sizes, *levels, offsets, children, table):
+            f.write(little_endian(values))
+        f.write(bytes(-f.tell() % 8))
+        f.write(little_endian(name_offsets))
+        f.write(b''.join(encoded))
+    os.replace(temporary, path)
+
+
+class Names():
+    def __init__(self, offsets, blob):
+        super().__init__()
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+# Read-only `Map` answering queries straight from a memory-mapped index, so
+# opening it costs the same whatever the size of the map. Only the pages
+# a query touches are read from disk.
+class MappedMap(Map):
+    def __init__(self, path):
+        super().__init__(())
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._map)
+        magic, version, self.source_hash, self.source_size, self.source_mtime = header[:5]
+        bodies, levels, slots, self._total, blob = header[5:]
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Not an orbit index: {}".format(path))
+        self._position = HEADER.size
+        self._parents = self.section('i', bodies)
+        self._depths = self.section('i', bodies)
+        self._sizes = self.section('i', bodies)
+        self._ancestors = [self._parents] + [self.section('i', bodies) for _ in range(levels)]
+        self._offsets = self.section('i', bodies + 1)
+        self._children = self.section('i', self._offsets[-1])
+        self._table = self.section('i', slots)
+        self._position += -self._position % 8
+        offsets = self.section('q', bodies + 1)
+        self._names = Names(offsets, memoryview(self._map)[self._position:self._position + blob])
+
+    def section(self, typecode, count):
+        start = self._position
+        end = self._position = start + count * array(typecode).itemsize
+        if sys.byteorder == 'little':
+            return memoryview(self._map)[start:end].cast(typecode)
+        values = array(typecode, self._map[start:end])
+        values.byteswap()
+        return values
+
+    def index(self, body):
+        encoded = body.encode()
+        mask = len(self._table) - 1
+        slot = zlib.crc32(encoded) & mask
+        offsets, blob = self._names.offsets, self._names.blob
+        while True:
+            i = self._table[slot]
+            if i < 0:
+                raise Exception("Unknown body: {}".format(body))
+            if blob[offsets[i]:offsets[i + 1]] == encoded:
+                return i
+            slot = (slot + 1) & mask
+
+    def add_orbit(self, center, orbit):
+        raise Exception("Mapped orbit maps are read-only")
+
+    def remove_orbit(self, orbit):
+        raise Exception("Mapped orbit maps are read-only")
+
+    def reparent(self, orbit, center):
+        raise Exception("Mapped orbit maps are read-only")
+
+    def memory_usage(self):
+        # Nothing is loaded, the index is only mapped
+        return len(self._map)
+
+
+def open_map(source, path=None):
+    # Maps the index of `source`, at `path` or next to it, first (re)building
+    # it if it's missing or stale. The source is only hashed when its size or
+    # modification time changed since the index was built, and if it's the
+    # same all the same, like after a fresh checkout, the index is stamped
+    # anew so that it isn't hashed again.
+    path = path or source + '.index'
+    try:
+        mapped = MappedMap(path)
+    except Exception:
+        # Missing, truncated or of another version
+        mapped = None
+    if mapped is not None:
+        stamp = source_stamp(source)
+        if (mapped.source_size, mapped.source_mtime) == stamp:
+            return mapped
+        if mapped.source_hash == source_hash(source):
+            with open(path, 'r+b') as f:
+                f.seek(STAMP_OFFSET)
+                f.write(STAMP.pack(*stamp))
+            mapped.source_size, mapped.source_mtime = stamp
+            return mapped
+    write(Map.from_file(source), path, source)
+    return MappedMap(path)
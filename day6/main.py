@@ -1,68 +1,332 @@
+import sys
+from array import array
 from collections import defaultdict
 class Map:
+    # `input` is the whole map as a string, or any iterable of its lines,
+    # like an open file, which is then read line by line.
+    #
+    # Body names are interned to dense ids in order of first appearance. The
+    # tree is kept in arrays indexed by id: the parent of every body (-1 for
+    # the ones orbiting nothing), and children in CSR layout, where the
+    # children of body `i` are `children[offsets[i]:offsets[i + 1]]`. Bodies
+    # whose children changed since loading have them in a list in `_changed`.
+    #
+    # Depths, subtree sizes, the total orbit count and the binary lifting
+    # table are built on first use, then kept up to date by `add_orbit`,
+    # `remove_orbit` and `reparent`. The `orbits` and `reverse_orbits` dicts
+    # are built on first use too, and dropped by any change.
     def __init__(self, input):
         super().__init__()
-        self.orbits = {}
-        self.reverse_orbits = defaultdict(list)
-        for line in input.split('\n'):
+        if isinstance(input, str):
+            input = input.split('\n')
+        self._ids = {}
+        self._names = []
+        self._parents = array('i')
+        self._depths = None
+        self._ancestors = None
+        self._orbits = None
+        self._reverse_orbits = None
+        for line in input:
             line = line.strip()
             if not line:
                 continue
             center, orbit = line.split(')')
-            self.orbits[orbit] = center
-            self.reverse_orbits[center].append(orbit)
+            self._parents[self.intern(orbit)] = self.intern(center)
+        self.link()
 
-    def all_orbits(self):
-        for orbit, center in self.orbits.items():
-            yield orbit
-            yield from self._recursive_orbits(orbit, center)
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            return cls(f)
 
-    def _recursive_orbits(self, orbit, current_ceneter):
-        if current_ceneter in self.orbits:
-            yield self.orbits[current_ceneter]
-            yield from self._recursive_orbits(orbit, self.orbits[current_ceneter])
+    def intern(self, name):
+        i = self._ids.get(name)
+        if i is None:
+            i = self._ids[name] = len(self._names)
+            self._names.append(name)
+            self._parents.append(-1)
+            if self._depths is not None:
+                self._depths.append(0)
+                self._sizes.append(1)
+            if self._ancestors is not None:
+                for level in self._ancestors[1:]:
+                    level.append(-1)
+        return i
 
-    def find_route(self, start="YOU", finish="SAN"):
-        start = self.orbits[start]
-        finish = self.orbits[finish]
-        for path in  self._walk(current_route=(None, start)):
-            if path[-1] == finish:
-                return self._flatten_path(path)
-
-    def _walk(self, current_route):
-        possible_jumps = []
-        location = current_route[-1]
-        for jump in self._possible_jumps(location):
-            if self._path_includes(current_route, jump):
+    def link(self):
+        offsets = array('i', [0]) * (len(self._names) + 1)
+        for parent in self._parents:
+            if parent >= 0:
+                offsets[parent + 1] += 1
+        for i in range(len(self._names)):
+            offsets[i + 1] += offsets[i]
+        children = array('i', [0]) * offsets[-1]
+        filled = offsets[:-1]
+        for i, parent in enumerate(self._parents):
+            if parent >= 0:
+                children[filled[parent]] = i
+                filled[parent] += 1
+        self._offsets, self._children = offsets, children
+        self._changed = {}
+
+    def children(self, i):
+        changed = self._changed.get(i)
+        if changed is not None:
+            return changed
+        if i + 1 < len(self._offsets):
+            return self._children[self._offsets[i]:self._offsets[i + 1]]
+        return ()
+
+    def changed_children(self, i):
+        if i not in self._changed:
+            self._changed[i] = list(self.children(i))
+        return self._changed[i]
+
+    def subtree(self, i):
+        # Body `i` and everything orbiting it, each after its center
+        bodies = [i]
+        for body in bodies:
+            bodies.extend(self.children(body))
+        return bodies
+
+    @property
+    def bodies(self):
+        # Names of every body, by id
+        return self._names
+
+    @property
+    def orbits(self):
+        # Body -> the body it orbits directly
+        if self._orbits is None:
+            names = self._names
+            self._orbits = {names[i]: names[parent] for i, parent in enumerate(self._parents) if parent >= 0}
+        return self._orbits
+
+    @property
+    def reverse_orbits(self):
+        # Body -> the bodies orbiting it directly, none for the others
+        if self._reverse_orbits is None:
+            names = self._names
+            self._reverse_orbits = defaultdict(list)
+            for i in range(len(names)):
+                children = self.children(i)
+                if children:
+                    self._reverse_orbits[names[i]] = [names[child] for child in children]
+        return self._reverse_orbits
+
+    def all_orbits(self):
+        names, parents = self._names, self._parents
+        for i, center in enumerate(parents):
+            if center < 0:
                 continue
-            possible_jumps.append(jump)
-            yield (current_route, jump)
-        # print("Route: ", self._flatten_path(current_route), "Jumps:", possible_jumps)
-        for jump in possible_jumps:
-            yield from self._walk((current_route, jump))
+            yield names[i]
+            center = parents[center]
+            while center >= 0:
+                yield names[center]
+                center = parents[center]
 
-    def _possible_jumps(self, location):
-        if location in self.orbits:
-            yield self.orbits[location]
-        yield from self.reverse_orbits[location]
+    def build_index(self):
+        # Walks the bodies breadth first from the ones orbiting nothing, so
+        # every body's center is done before the body itself, then goes back
+        # up the same order to add up subtree sizes
+        parents = self._parents
+        order = array('i', (i for i, parent in enumerate(parents) if parent < 0))
+        depths = array('i', [0]) * len(parents)
+        for i in order:
+            depth = depths[i] + 1
+            for child in self.children(i):
+                depths[child] = depth
+                order.append(child)
+        if len(order) != len(parents):
+            unreached = set(range(len(parents))) - set(order)
+            raise Exception("Orbits form a cycle: {}".format(sorted(self._names[i] for i in unreached)[:10]))
+        sizes = array('i', [1]) * len(parents)
+        for i in reversed(order):
+            if parents[i] >= 0:
+                sizes[parents[i]] += sizes[i]
+        self._depths, self._sizes = depths, sizes
+        self._total = sum(depths)
 
-    @classmethod
-    def _flatten_path(cls, path):
-        result_path = []
-        subpath, node = path
-        if subpath is None:
-            return [node]
-        return cls._flatten_path(subpath) + [node]
+    def indexed(self):
+        if self._depths is None:
+            self.build_index()
 
-    @classmethod
-    def _path_includes(cls, path, node):
-        return node in cls._flatten_path(path)
+    def index(self, body):
+        try:
+            return self._ids[body]
+        except KeyError:
+            raise Exception("Unknown body: {}".format(body))
+
+    def center(self, body):
+        parent = self._parents[self.index(body)]
+        if parent < 0:
+            raise Exception("{} doesn't orbit anything".format(body))
+        return self._names[parent]
+
+    def orbit_count(self):
+        self.indexed()
+        return self._total
+
+    def depth(self, body):
+        # Number of bodies it orbits, directly or not
+        self.indexed()
+        return self._depths[self.index(body)]
+
+    def subtree_size(self, body):
+        # Number of bodies orbiting it, directly or not, plus itself
+        self.indexed()
+        return self._sizes[self.index(body)]
+
+    def ancestors(self):
+        # Binary lifting table: `ancestors[k][i]` is the body 2**k levels
+        # above body `i`, or -1
+        if self._ancestors is None:
+            self.indexed()
+            levels = [self._parents]
+            while 1 << len(levels) <= max(self._depths, default=0):
+                previous = levels[-1]
+                levels.append(array('i', (previous[up] if up >= 0 else -1 for up in previous)))
+            self._ancestors = levels
+        return self._ancestors
+
+    def add_orbit(self, center, orbit):
+        # `orbit` may be new, or orbit nothing yet and bring its satellites along
+        i = self.intern(orbit)
+        if self._parents[i] >= 0:
+            raise Exception("{} already orbits {}".format(orbit, self.center(orbit)))
+        parent = self.intern(center)
+        self.check_orbit(i, parent)
+        self.attach(i, parent)
+
+    def remove_orbit(self, orbit):
+        # `orbit` stops orbiting anything, its satellites stay around it
+        i = self.index(orbit)
+        if self._parents[i] < 0:
+            raise Exception("{} doesn't orbit anything".format(orbit))
+        self.detach(i)
+
+    def reparent(self, orbit, center):
+        i = self.index(orbit)
+        parent = self.intern(center)
+        self.check_orbit(i, parent)
+        if self._parents[i] >= 0:
+            self.detach(i)
+        self.attach(i, parent)
+
+    def check_orbit(self, i, parent):
+        up = parent
+        while up >= 0:
+            if up == i:
+                raise Exception("{} can't orbit {}, which orbits it".format(self._names[i], self._names[parent]))
+            up = self._parents[up]
+
+    def attach(self, i, parent):
+        self._orbits = self._reverse_orbits = None
+        self._parents[i] = parent
+        self.changed_children(parent).append(i)
+        if self._depths is not None:
+            self.grow(parent, self._sizes[i])
+            self.moved(i, self._depths[parent] + 1)
+
+    def detach(self, i):
+        self._orbits = self._reverse_orbits = None
+        parent = self._parents[i]
+        self.changed_children(parent).remove(i)
+        self._parents[i] = -1
+        if self._depths is not None:
+            self.grow(parent, -self._sizes[i])
+            self.moved(i, 0)
+
+    def grow(self, i, size):
+        # Body `i` and everything it orbits gain `size` satellites
+        sizes, parents = self._sizes, self._parents
+        while i >= 0:
+            sizes[i] += size
+            i = parents[i]
+
+    def moved(self, i, depth):
+        # Body `i` now sits at `depth` below a new center, or none: updates
+        # its subtree's depths, the total and the lifting table
+        depths = self._depths
+        shift = depth - depths[i]
+        subtree = self.subtree(i)
+        self._total += shift * len(subtree)
+        for body in subtree:
+            depths[body] += shift
+        if self._ancestors is None:
+            return
+        if 1 << len(self._ancestors) <= max(depths[body] for body in subtree):
+            # Needs another level, so rebuild the table on next use
+            self._ancestors = None
+            return
+        for k in range(1, len(self._ancestors)):
+            previous, level = self._ancestors[k - 1], self._ancestors[k]
+            for body in subtree:
+                up = previous[body]
+                level[body] = previous[up] if up >= 0 else -1
+
+    def _common_ancestor(self, first, second):
+        ancestors = self.ancestors()
+        depths = self._depths
+        if depths[first] < depths[second]:
+            first, second = second, first
+        distance, k = depths[first] - depths[second], 0
+        while distance:
+            if distance & 1:
+                first = ancestors[k][first]
+            distance >>= 1
+            k += 1
+        if first == second:
+            return first
+        for level in reversed(ancestors):
+            if level[first] != level[second]:
+                first, second = level[first], level[second]
+        if self._parents[first] < 0:
+            raise Exception("No route between {} and {}".format(self._names[first], self._names[second]))
+        return self._parents[first]
+
+    def common_ancestor(self, first, second):
+        return self._names[self._common_ancestor(self.index(first), self.index(second))]
+
+    def distance(self, first, second):
+        # Orbital transfers between two bodies, in O(log N)
+        first, second = self.index(first), self.index(second)
+        common = self._common_ancestor(first, second)
+        return self._depths[first] + self._depths[second] - 2 * self._depths[common]
+
+    def route(self, first, second):
+        first, second = self.index(first), self.index(second)
+        common = self._common_ancestor(first, second)
+        up, down = [], []
+        for i, path in ((first, up), (second, down)):
+            while i != common:
+                path.append(self._names[i])
+                i = self._parents[i]
+        return up + [self._names[common]] + down[::-1]
+
+    def find_route(self, start="YOU", finish="SAN"):
+        return self.route(self.center(start), self.center(finish))
+
+    def transfers(self, pairs):
+        # Orbital transfers from what `start` orbits to what `finish` orbits, for every pair
+        return [self.distance(self.center(start), self.center(finish)) for start, finish in pairs]
+
+    def memory_usage(self):
+        # Bytes held by the map and its indexes, names included
+        arrays = [self._parents, self._offsets, self._children]
+        if self._depths is not None:
+            arrays += [self._depths, self._sizes]
+        if self._ancestors is not None:
+            arrays += self._ancestors[1:]
+        return (
+            sum(sys.getsizeof(a) for a in arrays)
+            + sys.getsizeof(self._ids) + sys.getsizeof(self._names)
+            + sum(sys.getsizeof(name) for name in self._names)
+        )
 
 if __name__ == "__main__":
-    import sys
-    sys.setrecursionlimit(10000)
-    with open('input') as f:
-        orbit_map = Map(f.read())
-    print("Total orbits: {}".format(len(list(orbit_map.all_orbits()))))
+    from index import open_map
+    orbit_map = open_map('input')
+    print("Total orbits: {}".format(orbit_map.orbit_count()))
     route = orbit_map.find_route()
-    print("Path from me to santa is {}. {} jumps".format(("->").join(route), len(route) - 1))
\ No newline at end of file
+    print("Path from me to santa is {}. {} jumps".format(("->").join(route), len(route) - 1))
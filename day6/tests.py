@@ -1,5 +1,11 @@
+import os
+import random
+import tempfile
+import tracemalloc
 import unittest
+from collections import defaultdict
 import main
+import index
 
 class OrbitsTest(unittest.TestCase):
     def test_part_1(self):
@@ -17,6 +23,9 @@ class OrbitsTest(unittest.TestCase):
             K)L
             ''')
         self.assertEqual(len(list(orbits_map.all_orbits())), 42)
+        self.assertEqual(orbits_map.orbit_count(), 42)
+        self.assertEqual(orbits_map.depth('L'), 7)
+        self.assertEqual(orbits_map.subtree_size('D'), 7)
 
     def test_part_2(self):
         orbits_map = main.Map('''
@@ -35,4 +44,131 @@ class OrbitsTest(unittest.TestCase):
             I)SAN
         ''')
         route = orbits_map.find_route()
-        self.assertEqual(route, list("KJEDI"))
\ No newline at end of file
+        self.assertEqual(route, list("KJEDI"))
+        self.assertEqual(orbits_map.distance('K', 'I'), 4)
+        self.assertEqual(orbits_map.common_ancestor('YOU', 'H'), 'B')
+        self.assertEqual(orbits_map.transfers([('YOU', 'SAN'), ('SAN', 'YOU'), ('L', 'H')]), [4, 4, 6])
+
+    def test_streaming_load(self):
+        lines = iter(["COM)B\n", "B)C\n", "\n", "C)YOU\n", "B)SAN\n"])
+        orbits_map = main.Map(lines)
+        self.assertEqual(orbits_map.orbits, {'B': 'COM', 'C': 'B', 'YOU': 'C', 'SAN': 'B'})
+        self.assertEqual(orbits_map.reverse_orbits, {'COM': ['B'], 'B': ['C', 'SAN'], 'C': ['YOU']})
+        self.assertIs(orbits_map.orbits, orbits_map.orbits)
+        self.assertEqual(orbits_map.reverse_orbits['YOU'], [])
+        self.assertEqual(orbits_map.find_route(), ['C', 'B'])
+        self.assertGreater(orbits_map.memory_usage(), 0)
+
+    def test_deep_map(self):
+        # One long chain and a short branch off its top, deeper than any recursion limit
+        lines = ["COM)0"] + ["{}){}".format(i, i + 1) for i in range(100000)] + ["1)YOU", "99999)SAN"]
+        orbits_map = main.Map("\n".join(lines))
+        self.assertEqual(orbits_map.orbit_count(), sum(range(100002)) + 3 + 100001)
+        self.assertEqual(orbits_map.subtree_size('COM'), 100004)
+        route = orbits_map.find_route()
+        self.assertEqual(len(route) - 1, 99998)
+        self.assertEqual(route[0], '1')
+        self.assertEqual(route[-1], '99999')
+
+    def test_memory_usage(self):
+        # Measured against dicts of names, as the map was held before
+        rng = random.Random(21)
+        text = "\n".join("{}){}".format(rng.randrange(i), i) for i in range(1, 20000))
+
+        def dicts():
+            orbits = {}
+            reverse_orbits = defaultdict(list)
+            for line in text.split('\n'):
+                center, orbit = line.split(')')
+                orbits[orbit] = center
+                reverse_orbits[center].append(orbit)
+            return orbits, reverse_orbits
+
+        def arrays():
+            orbits_map = main.Map(text)
+            orbits_map.orbit_count()
+            return orbits_map
+
+        sizes = []
+        for build in (dicts, arrays):
+            tracemalloc.start()
+            held = build()
+            sizes.append(tracemalloc.get_traced_memory()[0])
+            tracemalloc.stop()
+            del held
+        self.assertLess(sizes[1], sizes[0])
+
+    def test_incremental_updates(self):
+        rng = random.Random(6)
+        orbits = {str(i): str(rng.randrange(i)) for i in range(1, 200)}
+        orbits_map = main.Map("\n".join("{}){}".format(center, orbit) for orbit, center in orbits.items()))
+        orbits_map.distance('1', '2')
+        for step in range(300):
+            body = str(rng.randrange(1, 260))
+            center = str(rng.randrange(0, 260))
+            around = center
+            while around in orbits and around != body:
+                around = orbits[around]
+            if around == body:
+                with self.assertRaisesRegex(Exception, "can't orbit"):
+                    orbits_map.reparent(body, center)
+            elif body in orbits and rng.random() < 0.3:
+                orbits_map.remove_orbit(body)
+                del orbits[body]
+            elif body in orbits:
+                orbits_map.reparent(body, center)
+                orbits[body] = center
+            else:
+                orbits_map.add_orbit(center, body)
+                orbits[body] = center
+            rebuilt = main.Map("\n".join("{}){}".format(center, orbit) for orbit, center in orbits.items()))
+            self.assertEqual(orbits_map.orbit_count(), rebuilt.orbit_count())
+            self.assertEqual(orbits_map.orbits, orbits)
+            bodies = list(rebuilt.bodies)
+            for body in bodies:
+                self.assertEqual(orbits_map.depth(body), rebuilt.depth(body))
+                self.assertEqual(orbits_map.subtree_size(body), rebuilt.subtree_size(body))
+            for _ in range(10):
+                first, second = rng.choice(bodies), rng.choice(bodies)
+                try:
+                    expected = rebuilt.route(first, second)
+                except Exception:
+                    continue
+                self.assertEqual(orbits_map.route(first, second), expected)
+                self.assertEqual(orbits_map.distance(first, second), len(expected) - 1)
+
+    def test_mapped_index(self):
+        lines = ["COM)B", "B)C", "C)D", "D)E", "E)F", "B)G", "G)H", "D)I", "E)J", "J)K", "K)L", "K)YOU", "I)SAN"]
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'input')
+            with open(source, 'w') as f:
+                f.write("\n".join(lines))
+            mapped = index.open_map(source)
+            self.assertEqual(mapped.orbit_count(), 54)
+            self.assertEqual(mapped.find_route(), list("KJEDI"))
+            self.assertEqual(mapped.subtree_size('D'), 9)
+            self.assertEqual(sorted(mapped.all_orbits()), sorted(main.Map("\n".join(lines)).all_orbits()))
+            with self.assertRaisesRegex(Exception, "Unknown body"):
+                mapped.depth('Q')
+            with open(source, 'a') as f:
+                f.write("\nSAN)Q")
+            self.assertEqual(index.open_map(source).depth('Q'), 6)
+
+    def test_mapped_index_stamp(self):
+        hashes = []
+        def source_hash(path):
+            hashes.append(path)
+            return hashed(path)
+        hashed, index.source_hash = index.source_hash, source_hash
+        self.addCleanup(setattr, index, 'source_hash', hashed)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'input')
+            with open(source, 'w') as f:
+                f.write("COM)B\nB)C")
+            index.open_map(source)
+            self.assertEqual(len(hashes), 1)
+            # Same content, newer modification time
+            os.utime(source, ns=(0, 10 ** 18))
+            for _ in range(3):
+                self.assertEqual(index.open_map(source).orbit_count(), 3)
+            self.assertEqual(len(hashes), 2)
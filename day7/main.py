@@ -1,8 +1,193 @@
+import enum
+import hashlib
 import itertools
+import math
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from array import array
 
+OPERANDS = {
+    1: 3,
+    2: 3,
+    3: 1,
+    4: 1,
+    5: 2,
+    6: 2,
+    7: 3,
+    8: 3,
+    99: 0,
+}
+
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+# Stands in for pages of `low` nothing was written to yet. Never owned, so
+# never written to itself.
+ZERO_PAGE = array('q', bytes(8 * PAGE_SIZE))
+
+# Memory made of fixed-size `array('q')` pages. A page that has to hold a value
+# outside of 64 bits is turned into a plain list. Pages from address 0 through
+# the program and a little past it are in a list, `low`, indexed by page
+# number, so the hottest reads index two sequences and never hash; pages far
+# past it are sparse, in a dict, `pages`, and allocated on first write.
+# Pages are shared copy-on-write between forks: a page is copied on the first
+# write into it unless this memory is its only owner, so a fork costs about
+# the pages it writes to.
+class PagedMemory():
+    def __init__(self, program=()):
+        super().__init__()
+        self.low = []
+        for start in range(0, len(program), PAGE_SIZE):
+            self.low.append(self.new_page(program[start:start + PAGE_SIZE]))
+        self.pages = {}
+        self.owned = set(range(len(self.low)))
+
+    @staticmethod
+    def new_page(values):
+        # A copy of `values`, which may be shorter than a page, like the last
+        # one of a program
+        try:
+            page = array('q', values)
+        except OverflowError:
+            page = list(values)
+        if len(page) < PAGE_SIZE:
+            page.extend([0] * (PAGE_SIZE - len(page)))
+        return page
+
+    def fork(self):
+        self.owned.clear()
+        memory = PagedMemory()
+        memory.low = list(self.low)
+        memory.pages = dict(self.pages)
+        return memory
+
+    def page(self, number):
+        if number < len(self.low):
+            return self.low[number]
+        return self.pages.get(number)
+
+    def chunks(self):
+        # (first address, cells) of every page
+        for number, page in enumerate(self.low):
+            yield number << PAGE_BITS, page
+        for number, page in self.pages.items():
+            yield number << PAGE_BITS, page
+
+    def differences(self, other):
+        # (address, value) of every cell that differs from `other`. Pages
+        # both still share can't differ, and aren't compared.
+        numbers = set(range(max(len(self.low), len(other.low))))
+        numbers.update(self.pages, other.pages)
+        for number in sorted(numbers):
+            page = self.page(number)
+            original = other.page(number)
+            if page is original:
+                continue
+            start = number << PAGE_BITS
+            cells = itertools.zip_longest(page or (), original or (), fillvalue=0)
+            for offset, (value, expected) in enumerate(cells):
+                if value != expected:
+                    yield start + offset, value
+
+    def __getitem__(self, position):
+        if position < 0:
+            raise Exception("Negative address: {}".format(position))
+        page = self.page(position >> PAGE_BITS)
+        if page is None or (position & PAGE_MASK) >= len(page):
+            # No such page, or past the end of the last one of a program image
+            return 0
+        return page[position & PAGE_MASK]
+
+    def __setitem__(self, position, val):
+        if position < 0:
+            raise Exception("Negative address: {}".format(position))
+        number = position >> PAGE_BITS
+        low = self.low
+        if len(low) <= number < 2 * len(low) + 2:
+            # Near enough to grow `low` up to it, taking in the pages on the way
+            low.extend(self.pages.pop(n, ZERO_PAGE) for n in range(len(low), number + 1))
+        if number in self.owned:
+            page = low[number] if number < len(low) else self.pages[number]
+        else:
+            page = self.page(number)
+            if page is None:
+                page = array('q', bytes(8 * PAGE_SIZE))
+            else:
+                # Shared page may also be a read-only view of a program image
+                page = self.new_page(page)
+            self.set_page(number, page)
+            self.owned.add(number)
+        try:
+            page[position & PAGE_MASK] = val
+        except OverflowError:
+            page = list(page)
+            self.set_page(number, page)
+            page[position & PAGE_MASK] = val
+
+    def set_page(self, number, page):
+        if number < len(self.low):
+            self.low[number] = page
+        else:
+            self.pages[number] = page
+
+# Yielded by `Intcode.stream` when the machine waits for more input
+STARVED = object()
+
+class InputStarved(Exception):
+    pass
+
+class ChannelFull(Exception):
+    pass
+
+# Why a bounded `run` returned
+class Status(enum.Enum):
+    HALTED = "halted"
+    BLOCKED = "blocked on input"
+    BUDGET_EXHAUSTED = "budget exhausted"
+
+# Input read front to back, from a deque the caller may keep filling, from a
+# list, or lazily from any other iterable. Stands in for the reversed input list.
+class InputStream():
+    def __init__(self, source=()):
+        super().__init__()
+        if isinstance(source, deque):
+            self.pending, self.source = source, iter(())
+        elif hasattr(source, '__len__'):
+            # Nothing to gain from reading a list lazily, and a snapshot
+            # can then hold all of it
+            self.pending, self.source = deque(source), iter(())
+        else:
+            self.pending, self.source = deque(), iter(source)
+
+    def __len__(self):
+        if not self.pending:
+            self.pending.extend(itertools.islice(self.source, 1))
+        return len(self.pending)
+
+    def pop(self):
+        if not len(self):
+            raise InputStarved()
+        return self.pending.popleft()
+
+    def push(self, value):
+        self.pending.append(value)
+
+    def __iter__(self):
+        # Values left to read, last to be read first, like the input lists
+        # machines pop from the end, so snapshots and checkpoints store them
+        # as such. Values a lazy source hasn't produced yet aren't included.
+        return reversed(self.pending)
+
+# Machines aren't thread-safe: each one must be run by a single thread at a
+# time. Separate machines share no mutable state, even when forked from the
+# same machine or snapshot, so they can run on separate threads.
 class Intcode():
     def __init__(self, memory):
-        self.memory = memory
+        self.memory = PagedMemory(memory)
+        self._low = self.memory.low
+        self._owned = self.memory.owned
         self.cursor = 0
         self._input = []
         self._output = []
@@ -13,16 +198,63 @@ class Intcode():
             4: self.output_instruction,
             99: self.exit_instruction
         }
+        # address -> (op, handler, modes, operands count)
+        self._decoded = {}
         super().__init__()
 
-    def run(self, input=None):
+    def run(self, input=None, max_steps=None):
+        # With `max_steps`, runs at most that many instructions and returns a `Status`
         if input is not None:
             self._input = input
+        if max_steps is not None:
+            return self.run_slice(max_steps)
         res = self.tick()
         while not res:
             res = self.tick()
         return res
 
+    def run_slice(self, max_steps):
+        tick = self.tick
+        try:
+            for _ in range(max_steps):
+                cursor = self.cursor
+                res = tick()
+                if res:
+                    return Status.HALTED if res is True else Status.BLOCKED
+        except (InputStarved, ChannelFull):
+            self.cursor = cursor
+            return Status.BLOCKED
+        return Status.BUDGET_EXHAUSTED
+
+    def stream(self, input=()):
+        # Yields outputs as soon as they are produced. When input runs out,
+        # yields `STARVED` and retries once resumed; the missing input can be
+        # appended to the `input` deque or passed in with `send()`.
+        self._input = input = InputStream(input)
+        output = self._output
+        # Outputs from before streaming started, like the ones of a boot run, come first
+        while output:
+            sent = yield output.pop(0)
+            if sent is not None:
+                input.push(sent)
+        while True:
+            cursor = self.cursor
+            try:
+                res = self.tick()
+            except InputStarved:
+                self.cursor = cursor
+                res = STARVED
+            if output:
+                sent = yield output.pop()
+                if sent is not None:
+                    input.push(sent)
+            if res is True:
+                return
+            if res:
+                sent = yield STARVED
+                if sent is not None:
+                    input.push(sent)
+
     def output(self, val):
         self._output.append(val)
 
@@ -32,56 +264,118 @@ class Intcode():
     def pop_input(self):
         return self._input.pop()
 
+    # `set_memory`, `get` and `pop` index the pages of `low` directly, and
+    # only go through `PagedMemory` past them, to raise on negative addresses,
+    # or to copy a shared page, since they are the hottest path
     def set_memory(self, pos, val):
-        self.memory[pos] = val
+        number = pos >> PAGE_BITS
+        if number in self._owned:
+            try:
+                self._low[number][pos & PAGE_MASK] = val
+            except (IndexError, OverflowError):
+                # A sparse page, or a value that needs the page turned into a list
+                self.memory[pos] = val
+        else:
+            self.memory[pos] = val
+        if pos in self._decoded:
+            # Self-modifying code rewrote an instruction we've already decoded
+            del self._decoded[pos]
 
     def get(self, position):
+        if position >= 0:
+            try:
+                return self._low[position >> PAGE_BITS][position & PAGE_MASK]
+            except IndexError:
+                pass
         return self.memory[position]
 
+    def copy_memory(self, memory):
+        return memory.fork()
+
+    def snapshot(self):
+        return {
+            'memory': self.copy_memory(self.memory),
+            'cursor': self.cursor,
+            'input': list(self._input),
+            'output': list(self._output),
+        }
+
+    def restore(self, snapshot):
+        # Snapshot stays untouched, so it can be restored any number of times
+        self.memory = self.copy_memory(snapshot['memory'])
+        self._low = self.memory.low
+        self._owned = self.memory.owned
+        self.cursor = snapshot['cursor']
+        self._input = list(snapshot['input'])
+        self._output = list(snapshot['output'])
+        self._decoded = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        machine = cls([])
+        machine.restore(snapshot)
+        return machine
+
+    def fork(self):
+        return self.from_snapshot(self.snapshot())
+
     def pop(self):
-        val = self.memory[self.cursor]
-        self.cursor += 1
-        return val
+        cursor = self.cursor
+        self.cursor = cursor + 1
+        if cursor >= 0:
+            try:
+                return self._low[cursor >> PAGE_BITS][cursor & PAGE_MASK]
+            except IndexError:
+                pass
+        return self.memory[cursor]
 
     def pop_instruction(self):
-        instruction = self.pop()
+        address = self.cursor
+        decoded = self._decoded.get(address)
+        if decoded is None:
+            decoded = self.decode(self.pop())
+            self._decoded[address] = decoded
+        else:
+            self.cursor += 1
+        return decoded
+
+    def decode(self, instruction):
         encoded_modes, op = divmod(instruction, 100)
-        modes = {i: int(x) for i, x in enumerate(reversed(str(encoded_modes)))}
-        return op, modes
+        handler = self.instructions.get(op)
+        if handler is None:
+            raise Exception("Unknown instruction: {}".format(op))
+        modes = (encoded_modes % 10, encoded_modes // 10 % 10, encoded_modes // 100 % 10)
+        return op, handler, modes, OPERANDS[op]
 
     def tick(self):
-        instruction, modes = self.pop_instruction()
-        handler = self.instructions.get(instruction)
-        if handler is not None:
-            return handler(modes)
-        else:
-            raise Exception("Unknown instruction: {}".format(instruction))
+        _, handler, modes, _ = self.pop_instruction()
+        return handler(modes)
 
     def sum_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, left + right)
         return False
 
     def multiplication_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, left * right)
         return False
 
     def input_instruction(self, modes):
         output_position = self.pop()
-        assert modes.pop(0, 0) == 0, "Immediate mode for output?"
+        assert modes[0] == 0, "Immediate mode for output?"
         val = self.pop_input()
         self.set_memory(output_position, val)
         return False
 
     def output_instruction(self, modes):
-        val = self.get_arg(self.pop(), modes.pop(0, 0))
+        val = self.get_arg(self.pop(), modes[0])
         self.output(val)
         return False
 
@@ -112,30 +406,30 @@ class Jumper(Intcode):
         self.cursor = pointer
 
     def jump_if_true_instruction(self, modes):
-        condition = self.get_arg(self.pop(), modes.pop(0, 0))
-        pointer = self.get_arg(self.pop(), modes.pop(1, 0))
+        condition = self.get_arg(self.pop(), modes[0])
+        pointer = self.get_arg(self.pop(), modes[1])
         if condition != 0:
             self.set_cursor(pointer)
 
     def jump_if_false_instruction(self, modes):
-        condition = self.get_arg(self.pop(), modes.pop(0, 0))
-        pointer = self.get_arg(self.pop(), modes.pop(1, 0))
+        condition = self.get_arg(self.pop(), modes[0])
+        pointer = self.get_arg(self.pop(), modes[1])
         if condition == 0:
             self.set_cursor(pointer)
 
     def less_then_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, int(left < right))
         return False
 
     def equals_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
         output_position = self.pop()
-        assert modes.pop(2, 0) == 0, "Immediate mode for output?"
+        assert modes[2] == 0, "Immediate mode for output?"
         self.set_memory(output_position, int(left == right))
         return False
 
@@ -147,74 +441,669 @@ class ChainedJumper(Jumper):
             self.cursor -= 1
             # Something truthy to halt `run` function, but not true,
             # so we can tell the difference between input block and stop
-            return object()
+            return STARVED
+
+    def output_instruction(self, modes):
+        try:
+            return super().output_instruction(modes)
+        except ChannelFull:
+            # Retried once the reader has made room
+            self.cursor -= 2
+            return STARVED
 
-    def run(self, input=None):
+    def run(self, input=None, max_steps=None):
         if input is not None:
             if self._input is not None:
                 self._input = []
             input.extend(self._input)
             self._input = input
-        res = self.tick()
-        while not res:
-            res = self.tick()
+        return super().run(None, max_steps)
+
+
+# Fixed-size FIFO ring buffer, written as one machine's output and read as the
+# next machine's input, so values go from machine to machine without any list
+# in between. Writing into a full channel raises `ChannelFull`, which blocks a
+# `ChainedJumper`, or a machine running a slice, until its reader has caught
+# up, and reading an empty one raises `InputStarved`, like an `InputStream`.
+# `Scheduler` connects machines with them.
+class Channel():
+    def __init__(self, capacity=64):
+        super().__init__()
+        self.buffer = [0] * capacity
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        self.last = None
+        # Values written and read so far, to tell whether machines make progress
+        self.written = 0
+        self.read = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        count = self.count
+        if count == self.capacity:
+            raise ChannelFull()
+        self.buffer[(self.head + count) % self.capacity] = value
+        self.count = count + 1
+        self.last = value
+        self.written += 1
+
+    def full(self):
+        return self.count == self.capacity
+
+    def pop(self):
+        if not self.count:
+            raise InputStarved()
+        head = self.head
+        self.head = (head + 1) % self.capacity
+        self.count -= 1
+        self.read += 1
+        return self.buffer[head]
+
+    def __iter__(self):
+        # Last to be read first, like `InputStream`
+        for i in reversed(range(self.count)):
+            yield self.buffer[(self.head + i) % self.capacity]
+
+# Output of a machine that shares its readers' channels with other writers, or
+# has several readers or none: every value goes into each of the channels, as
+# long as they all have room for it.
+class Fanout():
+    def __init__(self, channels):
+        super().__init__()
+        self.channels = channels
+        self.last = None
+        self.written = 0
+
+    def append(self, value):
+        if self.full():
+            raise ChannelFull()
+        for channel in self.channels:
+            channel.append(value)
+        self.last = value
+        self.written += 1
+
+    def full(self):
+        return any(channel.full() for channel in self.channels)
+
+# Ends a pipe: sent by a machine once it stops, so readers know it won't write anymore
+EOF = object()
+
+def resume(stream, value=None):
+    try:
+        return stream.send(value)
+    except StopIteration:
+        return None
+
+# Machines running as asyncio tasks, talking over bounded queues. Every output
+# of a machine goes to each machine it's connected to, so any topology works:
+# chains, rings, fan-out and fan-in. Raises once every running machine is
+# blocked, either reading an empty inbox or writing into a full one.
+class Network():
+    def __init__(self, capacity=16):
+        super().__init__()
+        self.capacity = capacity
+        self.machines = {}
+        self.initial = {}
+        self.targets = {}
+        self.sources = {}
+        self.last_output = {}
+        self.status = {}
+
+    def add(self, name, machine, input=()):
+        self.machines[name] = machine
+        self.initial[name] = deque(input)
+        self.targets[name] = []
+        self.sources[name] = 0
+
+    def connect(self, source, target):
+        self.targets[source].append(target)
+        self.sources[target] += 1
+
+    def run(self):
+        # Imported here, as it takes longer to import than most runs take
+        import asyncio
+        asyncio.run(self.serve())
+        return self.last_output
+
+    async def serve(self):
+        import asyncio
+        self.inboxes = {name: asyncio.Queue(self.capacity) for name in self.machines}
+        self._running = set(self.machines)
+        self._starving = set()
+        # name -> machine whose full inbox it waits to write into
+        self._writing = {}
+        await asyncio.gather(*(self.drive(name) for name in self.machines))
+
+    async def drive(self, name):
+        inbox = self.inboxes[name]
+        sources = self.sources[name]
+        stream = self.machines[name].stream(self.initial[name])
+        value = resume(stream)
+        while value is not None:
+            if value is STARVED:
+                if not sources:
+                    break
+                sent = await self.receive(name)
+                if sent is EOF:
+                    sources -= 1
+                else:
+                    value = resume(stream, sent)
+                continue
+            for target in self.targets[name]:
+                await self.send(name, target, value)
+            self.last_output[name] = value
+            value = resume(stream)
+        self.status[name] = "starved" if value is STARVED else "halted"
+        self._running.discard(name)
+        for target in self.targets[name]:
+            await self.inboxes[target].put(EOF)
+        self.check_deadlock()
+        # Keep draining, so writers are never stuck on a full queue of a stopped machine
+        while sources:
+            if await inbox.get() is EOF:
+                sources -= 1
+
+    async def receive(self, name):
+        inbox = self.inboxes[name]
+        if inbox.empty():
+            self._starving.add(name)
+            self.check_deadlock()
+        try:
+            return await inbox.get()
+        finally:
+            self._starving.discard(name)
+
+    async def send(self, name, target, value):
+        inbox = self.inboxes[target]
+        if inbox.full():
+            self._writing[name] = target
+            self.check_deadlock()
+        try:
+            await inbox.put(value)
+        finally:
+            self._writing.pop(name, None)
+
+    def check_deadlock(self):
+        # A machine marked as blocked may just not have been woken up yet,
+        # so it only counts while its inbox is still empty, or its target's
+        # inbox still full
+        if not self._running:
+            return
+        for name in self._running:
+            if name in self._starving:
+                if not self.inboxes[name].empty():
+                    return
+            elif name in self._writing:
+                if not self.inboxes[self._writing[name]].full():
+                    return
+            else:
+                return
+        raise Exception("Deadlock: {} are all blocked".format(sorted(map(str, self._running))))
+
+# Runs machines round-robin in the current thread, `quantum` instructions at a
+# time, so no machine can hold up the others. Every machine reads from a
+# `Channel` of `capacity` values. A machine writes straight into the channel
+# of the machine it's connected to when it's the only one writing there, or
+# through a `Fanout` otherwise. Machines blocked on input are parked until
+# some input arrives for them, so thousands of mostly idle machines cost
+# nothing, and so are machines blocked on a full channel, until their reader
+# makes room. `run` returns once every machine is halted or parked, and raises
+# if parked machines are waiting on each other.
+class Scheduler():
+    def __init__(self, quantum=1000, capacity=1024):
+        super().__init__()
+        self.quantum = quantum
+        self.capacity = capacity
+        self.machines = {}
+        self.inputs = {}
+        # name -> `Channel` or `Fanout` its machine writes into
+        self.outputs = {}
+        # name -> outputs from before it was added
+        self.pending = {}
+        self.targets = {}
+        self.sources = {}
+        self.last_output = {}
+        self.status = {}
+        # name -> seconds spent running it
+        self.cpu = {}
+        self.slices = {}
+        self.ready = deque()
+        self.parked = set()
+        # name -> machines waiting for room in its channel
+        self.writers = {}
+
+    def add(self, name, machine, input=()):
+        input = list(input)
+        self.machines[name] = machine
+        self.inputs[name] = machine._input = Channel(max(self.capacity, len(input)))
+        for value in input:
+            self.inputs[name].append(value)
+        self.pending[name] = deque(machine.get_output())
+        self.targets[name] = []
+        self.sources[name] = []
+        self.cpu[name] = 0
+        self.slices[name] = 0
+        self.ready.append(name)
+
+    def connect(self, source, target):
+        self.targets[source].append(target)
+        self.sources[target].append(source)
+        # Wired again on their next slice
+        for name in self.sources[target]:
+            self.outputs.pop(name, None)
+
+    def output(self, name):
+        targets = self.targets[name]
+        if len(targets) == 1 and len(self.sources[targets[0]]) == 1:
+            output = self.inputs[targets[0]]
+        else:
+            output = Fanout([self.inputs[target] for target in targets])
+        self.outputs[name] = self.machines[name]._output = output
+        return output
+
+    def send(self, name, value):
+        # Raises `ChannelFull` if `name` has `capacity` values left to read
+        self.inputs[name].append(value)
+        if name in self.parked:
+            self.parked.discard(name)
+            self.ready.append(name)
+
+    def run(self):
+        ready = self.ready
+        statuses = self.status
+        cpu = self.cpu
+        slices = self.slices
+        parked = self.parked
+        clock = time.perf_counter
+        while ready:
+            name = ready.popleft()
+            machine = self.machines[name]
+            output = self.outputs.get(name)
+            if output is None:
+                output = self.output(name)
+            written = output.written
+            # Outputs from before it was added go first
+            pending = self.pending[name]
+            while pending and not output.full():
+                output.append(pending.popleft())
+            status = statuses.get(name)
+            if not pending and status is not Status.HALTED:
+                start = clock()
+                status = statuses[name] = machine.run(max_steps=self.quantum)
+                cpu[name] += clock() - start
+                slices[name] += 1
+                if self.writers:
+                    self.wake_writers(name)
+            if output.written != written:
+                self.last_output[name] = output.last
+                for target in self.targets[name]:
+                    if target in parked:
+                        parked.discard(target)
+                        ready.append(target)
+            # A blocked machine is left at the instruction it's blocked on
+            if pending or (status is Status.BLOCKED and output.full() and machine.memory[machine.cursor] % 100 == 4):
+                for target in self.targets[name]:
+                    if self.inputs[target].full():
+                        self.writers.setdefault(target, set()).add(name)
+            elif status is Status.BUDGET_EXHAUSTED:
+                ready.append(name)
+            elif status is Status.BLOCKED:
+                if self.inputs[name].count:
+                    ready.append(name)
+                else:
+                    parked.add(name)
+        self.check_deadlock()
+        return self.last_output
+
+    def wake_writers(self, name):
+        writers = self.writers.get(name)
+        if writers and not self.inputs[name].full():
+            self.ready.extend(writers)
+            writers.clear()
+
+    def idle(self):
+        return not self.ready
+
+    def check_deadlock(self):
+        # Parked machines without sources wait for `send`, as does everything
+        # downstream of them. Of the other parked machines, peel off the ones
+        # only fed by halted machines: what is left waits on each other in a cycle.
+        reachable = {name for name in self.parked if not self.sources[name]}
+        pending = list(reachable)
+        while pending:
+            for target in self.targets[pending.pop()]:
+                if target in self.parked and target not in reachable:
+                    reachable.add(target)
+                    pending.append(target)
+        # Nothing will read from the full channels writers wait on anymore
+        writing = set().union(*self.writers.values())
+        stuck = self.parked - reachable
+        feeding = {
+            name: sum(source in stuck or source in writing for source in self.sources[name])
+            for name in stuck
+        }
+        pending = [name for name, count in feeding.items() if not count]
+        while pending:
+            name = pending.pop()
+            stuck.discard(name)
+            for target in self.targets[name]:
+                if target in stuck:
+                    feeding[target] -= 1
+                    if not feeding[target]:
+                        pending.append(target)
+        stuck |= writing
+        if stuck:
+            raise Exception("Deadlock: {} are all blocked".format(sorted(map(str, stuck))))
+
+    def shares(self):
+        total = sum(self.cpu.values())
+        return {name: cpu / total if total else 0 for name, cpu in self.cpu.items()}
+
+CYCLE_HOOKS = ('tick', 'set_memory', 'output', 'pop_input')
+HASH_MASK = (1 << 64) - 1
+
+def cell_hash(position, value):
+    # Zero cells hash to 0, so untouched memory needs no hashing at all
+    return hash((position, value)) & HASH_MASK if value else 0
+
+def same_memory(left, right):
+    return next(left.differences(right), None) is None
+
+class CycleDetected(Exception):
+    def __init__(self, address, period):
+        super().__init__("Infinite loop at {}, repeating every {} instructions".format(address, period))
+        self.address = address
+        self.period = period
+
+# A plain interpreter started from a state a detector went through, with the
+# hash of its memory kept up to date, to walk a cycle one instruction at a time
+class Replay():
+    def __init__(self, memory, cursor, memory_hash):
+        super().__init__()
+        self.machine = Jumper.from_snapshot({'memory': memory, 'cursor': cursor, 'input': [], 'output': []})
+        self.memory_hash = memory_hash
+        self._set_memory = self.machine.set_memory
+        self.machine.set_memory = self.set_memory
+
+    def state(self):
+        return self.memory_hash, self.machine.cursor
+
+    def same(self, other):
+        return self.state() == other.state() and same_memory(self.machine.memory, other.machine.memory)
+
+    def step(self):
+        if self.machine.tick():
+            # The detector only goes through states that don't do input or output
+            raise Exception("Replay left the cycle at {}".format(self.machine.cursor))
+
+    def set_memory(self, pos, val):
+        self.memory_hash ^= cell_hash(pos, self.machine.memory[pos]) ^ cell_hash(pos, val)
+        return self._set_memory(pos, val)
+
+# Raises `CycleDetected` from a machine that went back to an earlier state
+# without reading input or writing output, so it would loop forever.
+#
+# Memory is hashed once, then the hash is updated on every write. Cycles are
+# searched with Brent's algorithm: a state is marked at every power of two
+# instructions since the last input or output, and the first later state with
+# the same hash and cursor is compared with the marked one cell by cell, so a
+# reported cycle is never a hash collision. The second phase is replayed from
+# the first marked state with `Replay`, so `address` is the cursor of the
+# first state on the cycle and `period` its length.
+#
+# Hooks are set as attributes of the machine itself, wrapping whatever it had;
+# detectors are detached in reverse order of attaching.
+class CycleDetector():
+    def __init__(self, machine):
+        super().__init__()
+        self.machine = machine
+        self.memory_hash = 0
+        for start, cells in machine.memory.chunks():
+            for offset, value in enumerate(cells):
+                self.memory_hash ^= cell_hash(start + offset, value)
+        self.steps = 0
+        self.reset()
+        self.shadowed = {name: machine.__dict__[name] for name in CYCLE_HOOKS if name in machine.__dict__}
+        for name in CYCLE_HOOKS:
+            setattr(self, '_' + name, getattr(machine, name))
+            setattr(machine, name, getattr(self, name))
+
+    def detach(self):
+        for name in CYCLE_HOOKS:
+            if name in self.shadowed:
+                setattr(self.machine, name, self.shadowed[name])
+            else:
+                del self.machine.__dict__[name]
+
+    def reset(self):
+        self.mark = None
+        self.marked_memory = None
+        self.origin = None
+        self.interval = 1
+        self.since = 0
+
+    def state(self):
+        return self.memory_hash, self.machine.cursor
+
+    def tick(self):
+        res = self._tick()
+        if res and res is not True:
+            # Starved for input: the instruction will be retried, it didn't run
+            return res
+        self.steps += 1
+        self.since += 1
+        state = self.state()
+        if state == self.mark and same_memory(self.machine.memory, self.marked_memory):
+            raise CycleDetected(*self.entry())
+        if self.since == self.interval:
+            self.mark = state
+            self.marked_memory = self.machine.copy_memory(self.machine.memory)
+            if self.origin is None:
+                self.origin = (self.marked_memory, self.machine.cursor, self.memory_hash)
+            self.interval *= 2
+            self.since = 0
         return res
 
+    def entry(self):
+        # Brent's second phase: the period, walking the cycle from here, then a
+        # replay from the origin and one a period ahead of it, in lockstep
+        # until they meet on the first state of the cycle
+        machine = self.machine
+        here = Replay(machine.memory, machine.cursor, self.memory_hash)
+        probe = Replay(machine.memory, machine.cursor, self.memory_hash)
+        period = 0
+        while True:
+            probe.step()
+            period += 1
+            if probe.same(here):
+                break
+        tortoise = Replay(*self.origin)
+        hare = Replay(*self.origin)
+        for _ in range(period):
+            hare.step()
+        while not tortoise.same(hare):
+            tortoise.step()
+            hare.step()
+        return tortoise.machine.cursor, period
+
+    def set_memory(self, pos, val):
+        self.memory_hash ^= cell_hash(pos, self.machine.memory[pos]) ^ cell_hash(pos, val)
+        return self._set_memory(pos, val)
+
+    def output(self, val):
+        self.reset()
+        return self._output(val)
+
+    def pop_input(self):
+        val = self._pop_input()
+        self.reset()
+        return val
+
+# Least recently used entries are evicted once there are more than `size`.
+# Safe to share between threads; values are computed outside of the lock, so
+# two threads missing the same key at once both compute it.
+class StageCache():
+    def __init__(self, size=4096):
+        super().__init__()
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
 
 class AmplifierSequence():
-    def __init__(self, program):
+    def __init__(self, program, cache=None):
         super().__init__()
         self.program = program
+        self.program_hash = hashlib.sha1(repr(list(program)).encode()).hexdigest()
+        # Cache may be shared between sequences, entries are keyed by program
+        self.cache = cache if cache is not None else StageCache()
+        self._boot = None
+        self._boot_lock = threading.Lock()
+
+    def boot(self):
+        # Runs the program up to its first input once, every amplifier forks
+        # from there. None if the program doesn't stop for input, as then
+        # there's nothing to share.
+        with self._boot_lock:
+            if self._boot is None:
+                computer = ChainedJumper(self.program)
+                if computer.run([]) is STARVED:
+                    self._boot = computer.snapshot()
+                else:
+                    self._boot = False
+        return self._boot or None
+
+    def amplifier(self, cls=Jumper):
+        snapshot = self.boot()
+        if snapshot is None:
+            return cls(self.program)
+        return cls.from_snapshot(snapshot)
 
     def range(self):
         return range(0, 5)
 
-    def best_sequence(self):
-        def sequences():
-            for sequence in itertools.permutations(list(self.range()), 5):
-                output = self.output(sequence)
-                yield output, sequence
-        results = list(sequences())
-        best_sequence = max(results, key=lambda x: x[0])
-        return best_sequence
+    def best_sequence(self, workers=1, prefix=(), threads=False):
+        # `workers` other than 1 searches in a process pool (`None` for one
+        # process per core), or in a thread pool with `threads`, which only
+        # pays off on free-threaded builds. `prefix` limits the search to
+        # sequences starting with it
+        if workers != 1:
+            return self.parallel_best_sequence(workers, threads)
+        return max(self.sequences(prefix), key=lambda x: x[0])
+
+    def sequences(self, prefix=()):
+        # Walks permutations depth first, as a trie, so every distinct prefix
+        # is run once, in the same order as `itertools.permutations`
+        yield from self.walk(prefix, self.output(prefix))
+
+    def walk(self, prefix, signal):
+        phases = [phase for phase in self.range() if phase not in prefix]
+        if not phases:
+            yield signal, prefix
+        for phase in phases:
+            yield from self.walk((*prefix, phase), self.stage(phase, signal))
+
+    def parallel_best_sequence(self, workers, threads=False):
+        import concurrent.futures
+        workers = workers or os.cpu_count()
+        shards = sequence_prefixes(list(self.range()), 4 * workers)
+        if threads:
+            # Threads share this sequence, its boot snapshot and its stage cache
+            pool = concurrent.futures.ThreadPoolExecutor(workers)
+            search = lambda prefix: self.best_sequence(prefix=prefix)
+        else:
+            pool = concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker, initargs=(type(self), self.program))
+            search = best_sequence_in_worker
+        with pool:
+            # `map` hands the shards back in order, so ties resolve the same way as serially
+            return max(pool.map(search, shards), key=lambda x: x[0])
 
     def output(self, sequence):
         signal = 0
         for phase in sequence:
-            computer = Jumper(self.program[:])
-            #Input reading implemented as `.pop()`, so reversing an order
-            computer.run([signal, phase])
-            signal = computer.get_output()[-1]
+            signal = self.stage(phase, signal)
         return signal
 
+    def stage(self, phase, signal):
+        return self.cache.get((self.program_hash, phase, signal), lambda: self.amplify(phase, signal))
+
+    def amplify(self, phase, signal):
+        # Last output of the amplifier, once it halts
+        output = None
+        for value in self.amplifier().stream([phase, signal]):
+            if value is STARVED:
+                raise Exception("Amplifier wants more input than its phase and signal")
+            output = value
+        return output
+
 class ChainedAmplifierSequence(AmplifierSequence):
-    def __init__(self, program):
+    def __init__(self, program, detect_cycles=False):
         super().__init__(program)
+        # Fail with `CycleDetected` rather than hang when an amplifier loops forever
+        self.detect_cycles = detect_cycles
 
     def range(self):
         return range(5, 10)
 
+    def sequences(self, prefix=()):
+        # Amplifiers feed back into each other, so no stage can be reused
+        phases = [phase for phase in self.range() if phase not in prefix]
+        for rest in itertools.permutations(phases):
+            sequence = (*prefix, *rest)
+            yield self.output(sequence), sequence
+
     def output(self, sequence):
-        interpreters = [ChainedJumper(self.program[:]) for _ in range(5)]
-        output = [0]
-        for iteration in itertools.count():
-            for i, interpreter, setting in zip(range(5), interpreters, sequence):
-                if interpreter is None:
-                    if i == 0:
-                        return output[0]
-                    raise Exception("Interpreter is called after halting #{}".format(i))
-                if iteration == 0:
-                    #Reverse, because stack
-                    result = interpreter.run([*output, setting])
-                else:
-                    result = interpreter.run(output)
-                output = interpreter.get_output()[::-1]
-                interpreter._output = []
-                if result is True:
-                    if i == 4:
-                        return output[0]
-                    else:
-                        interpreters[i] = None
+        # Amplifier `i` feeds amplifier `i + 1`, the last one feeds back into
+        # the first. Whatever they print while booting goes out first.
+        scheduler = Scheduler(quantum=100000, capacity=64)
+        for i, setting in enumerate(sequence):
+            # Blocks on input and on a full channel without raising
+            machine = self.amplifier(ChainedJumper)
+            if self.detect_cycles:
+                CycleDetector(machine)
+            scheduler.add(i, machine, [setting, 0] if i == 0 else [setting])
+        for i in range(len(sequence)):
+            scheduler.connect(i, (i + 1) % len(sequence))
+        last_output = scheduler.run()
+        if set(scheduler.status.values()) != {Status.HALTED}:
+            raise Exception("Deadlock: amplifiers of {} wait for input no amplifier will send".format(sequence))
+        return last_output[len(sequence) - 1]
+
+# Program is shipped to every worker once, at startup, rather than with each shard
+_worker_sequence = None
+
+def init_worker(cls, program):
+    global _worker_sequence
+    _worker_sequence = cls(program)
+
+def best_sequence_in_worker(prefix):
+    return _worker_sequence.best_sequence(prefix=prefix)
+
+def sequence_prefixes(phases, shards):
+    # Shortest prefixes that split the permutations into at least `shards` parts
+    length = next(
+        (length for length in range(len(phases)) if math.perm(len(phases), length) >= shards),
+        len(phases)
+    )
+    return itertools.permutations(phases, length)
 
 if __name__ == "__main__":
     with open('input') as f:
@@ -0,0 +1,208 @@
+import unittest
+import main
+
+class AmplifiersTest(unittest.TestCase):
+    def test_sequence(self):
+        program = [3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0]
+        seq = main.AmplifierSequence(program)
+        self.assertEqual(seq.best_sequence(), (43210, (4, 3, 2, 1, 0)))
+
+    def test_chained_sequence(self):
+        program = [
+            3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,
+            4,27,1001,28,-1,28,1005,28,6,99,0,0,5
+        ]
+        seq = main.ChainedAmplifierSequence(program)
+        self.assertEqual(seq.best_sequence(), (139629729, (9, 8, 7, 6, 5)))
+        seq = main.ChainedAmplifierSequence(program, detect_cycles=True)
+        self.assertEqual(seq.best_sequence(), (139629729, (9, 8, 7, 6, 5)))
+
+    def test_chained_sequence_loops_forever(self):
+        # Reads its phase and a signal, then jumps to itself
+        program = [3,9,3,9,1105,1,4,0,0,0]
+        seq = main.ChainedAmplifierSequence(program, detect_cycles=True)
+        with self.assertRaises(main.CycleDetected) as caught:
+            seq.best_sequence()
+        self.assertEqual((caught.exception.address, caught.exception.period), (4, 1))
+
+    def test_cycle_entry_inside_the_loop(self):
+        # Counts to 5, then jumps into the middle of a loop from 14 to 20 that
+        # negates 32 twice per cycle, so the cycle starts at 18
+        program = [1001,30,1,30,1007,30,5,31,1005,31,0,1105,1,18,1002,32,-1,32,1105,1,14] + [0] * 11 + [1]
+        computer = main.Jumper(program)
+        first = main.CycleDetector(computer)
+        second = main.CycleDetector(computer)
+        with self.assertRaises(main.CycleDetected) as caught:
+            computer.run([])
+        self.assertEqual((caught.exception.address, caught.exception.period), (18, 4))
+        second.detach()
+        self.assertEqual(computer.tick, first.tick)
+        first.detach()
+        self.assertEqual(vars(computer).keys() & set(main.CYCLE_HOOKS), set())
+
+    def test_channel(self):
+        # Prints 1, 2 and 3
+        program = [104,1,104,2,104,3,99]
+        channel = main.Channel(capacity=2)
+        computer = main.ChainedJumper(program)
+        computer._output = channel
+        self.assertIs(computer.run(), main.STARVED)
+        self.assertEqual(channel.pop(), 1)
+        self.assertIs(computer.run(), True)
+        self.assertEqual([channel.pop(), channel.pop()], [2, 3])
+        self.assertEqual((len(channel), channel.written, channel.read), (0, 3, 3))
+
+    def test_chained_sequence_deadlock(self):
+        # Reads its phase and two more inputs before printing anything
+        program = [3,11,3,11,3,11,4,11,1105,1,0,0]
+        seq = main.ChainedAmplifierSequence(program)
+        with self.assertRaisesRegex(Exception, "Deadlock"):
+            seq.output((5, 6, 7, 8, 9))
+
+    def test_fork_does_not_touch_parent(self):
+        # Stores its input at 7 and prints it
+        program = [3,7,4,7,99,0,0,0]
+        computer = main.Jumper(program)
+        fork = computer.fork()
+        fork.run([42])
+        computer.run([1])
+        self.assertEqual(fork.get_output(), [42])
+        self.assertEqual(computer.get_output(), [1])
+
+    def test_fork_copies_written_pages_only(self):
+        # Stores its input in the third page of the program
+        program = [3,2500,99] + [0] * 3000
+        computer = main.Jumper(program)
+        fork = computer.fork()
+        fork.run([7])
+        shared = [page is original for page, original in zip(fork.memory.low, computer.memory.low)]
+        self.assertEqual(shared, [True, True, False])
+
+    def test_network_fan_out(self):
+        # Adds 1 to every input until it gets 0
+        program = [3,15,1006,15,14,101,1,15,15,4,15,1105,1,0,99,0]
+        network = main.Network()
+        network.add('source', main.Jumper(program), [1, 2, 0])
+        network.add('left', main.Jumper(program))
+        network.add('right', main.Jumper(program))
+        network.connect('source', 'left')
+        network.connect('source', 'right')
+        self.assertEqual(network.run(), {'source': 3, 'left': 4, 'right': 4})
+        self.assertEqual(network.status, {'source': 'halted', 'left': 'starved', 'right': 'starved'})
+
+    def test_network_deadlock(self):
+        program = [3,7,4,7,99,0,0,0]
+        network = main.Network()
+        network.add('a', main.Jumper(program))
+        network.add('b', main.Jumper(program))
+        network.connect('a', 'b')
+        network.connect('b', 'a')
+        with self.assertRaisesRegex(Exception, "Deadlock"):
+            network.run()
+
+    def test_bounded_run(self):
+        program = [3,7,4,7,99,0,0,0]
+        computer = main.ChainedJumper(program)
+        self.assertIs(computer.run([], max_steps=10), main.Status.BLOCKED)
+        self.assertIs(computer.run([42], max_steps=1), main.Status.BUDGET_EXHAUSTED)
+        self.assertIs(computer.run(max_steps=10), main.Status.HALTED)
+        self.assertEqual(computer.get_output(), [42])
+
+    def test_scheduler_ring(self):
+        program = [
+            3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,
+            4,27,1001,28,-1,28,1005,28,6,99,0,0,5
+        ]
+        scheduler = main.Scheduler(quantum=3)
+        for i, setting in enumerate((9, 8, 7, 6, 5)):
+            scheduler.add(i, main.ChainedJumper(program), [setting, 0] if i == 0 else [setting])
+        for i in range(5):
+            scheduler.connect(i, (i + 1) % 5)
+        self.assertEqual(scheduler.run()[4], 139629729)
+        self.assertEqual(set(scheduler.status.values()), {main.Status.HALTED})
+        self.assertAlmostEqual(sum(scheduler.shares().values()), 1)
+
+    def test_scheduler_idle_and_deadlock(self):
+        # Adds 1 to every input until it gets 0
+        program = [3,15,1006,15,14,101,1,15,15,4,15,1105,1,0,99,0]
+        scheduler = main.Scheduler()
+        scheduler.add('source', main.Jumper(program))
+        scheduler.add('sink', main.Jumper(program))
+        scheduler.connect('source', 'sink')
+        self.assertEqual(scheduler.run(), {})
+        self.assertTrue(scheduler.idle())
+        scheduler.send('source', 1)
+        self.assertEqual(scheduler.run(), {'source': 2, 'sink': 3})
+        scheduler.connect('sink', 'source')
+        with self.assertRaisesRegex(Exception, "Deadlock"):
+            scheduler.run()
+
+    def test_scheduler_full_channels(self):
+        # Prints 0 to 39, then reads
+        program = [4,20,1001,20,1,20,1007,20,40,21,1005,21,0,3,22,99] + [0] * 7
+        for cls in (main.Jumper, main.ChainedJumper):
+            scheduler = main.Scheduler(quantum=5, capacity=16)
+            scheduler.add('a', cls(program))
+            scheduler.add('b', cls(program))
+            scheduler.connect('a', 'b')
+            scheduler.connect('b', 'a')
+            with self.assertRaisesRegex(Exception, "Deadlock"):
+                scheduler.run()
+            # Room enough, both print everything, read one value and halt
+            scheduler = main.Scheduler(quantum=5, capacity=64)
+            scheduler.add('a', cls(program))
+            scheduler.add('b', cls(program[:]))
+            scheduler.connect('a', 'b')
+            scheduler.connect('b', 'a')
+            self.assertEqual(scheduler.run(), {'a': 39, 'b': 39})
+            self.assertEqual(set(scheduler.status.values()), {main.Status.HALTED})
+        # Prints 1 to 40 into a machine adding 1 to every input, 4 at a time
+        scheduler = main.Scheduler(quantum=5, capacity=4)
+        scheduler.add('source', main.Jumper([4,20,1001,20,1,20,1007,20,41,21,1005,21,0,99] + [0] * 6 + [1,0]))
+        scheduler.add('sink', main.Jumper([3,15,1006,15,14,101,1,15,15,4,15,1105,1,0,99,0]))
+        scheduler.connect('source', 'sink')
+        self.assertEqual(scheduler.run(), {'source': 40, 'sink': 41})
+
+    def test_network_deadlock_on_full_queues(self):
+        # Prints 0 to 39, then reads
+        program = [4,20,1001,20,1,20,1007,20,40,21,1005,21,0,3,22,99] + [0] * 7
+        network = main.Network()
+        network.add('a', main.Jumper(program))
+        network.add('b', main.Jumper(program))
+        network.connect('a', 'b')
+        network.connect('b', 'a')
+        with self.assertRaisesRegex(Exception, "Deadlock"):
+            network.run()
+
+    def test_sequence_without_input(self):
+        # Halts before ever reading, so there's no boot snapshot to share
+        self.assertEqual(main.AmplifierSequence([104,7,99]).output((0,1,2,3,4)), 7)
+        # Prints during boot, then reads its phase and signal
+        program = [104,1,3,9,3,9,99,0,0,0]
+        self.assertEqual(main.AmplifierSequence(program).output((0,1,2,3,4)), 1)
+        with self.assertRaisesRegex(Exception, "more input"):
+            main.AmplifierSequence([3,9,3,9,3,9,99,0,0,0]).output((0,1,2,3,4))
+
+    def test_parallel_sequence(self):
+        program = [3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0]
+        seq = main.AmplifierSequence(program)
+        self.assertEqual(seq.best_sequence(workers=2), seq.best_sequence())
+
+    def test_threaded_sequence(self):
+        program = [3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0]
+        seq = main.AmplifierSequence(program)
+        self.assertEqual(seq.best_sequence(workers=4, threads=True), (43210, (4, 3, 2, 1, 0)))
+        program = [
+            3,26,1001,26,-4,26,3,27,1002,27,2,27,1,27,26,27,
+            4,27,1001,28,-1,28,1005,28,6,99,0,0,5
+        ]
+        seq = main.ChainedAmplifierSequence(program)
+        self.assertEqual(seq.best_sequence(workers=4, threads=True), (139629729, (9, 8, 7, 6, 5)))
+
+    def test_stage_cache(self):
+        program = [3,15,3,16,1002,16,10,16,1,16,15,15,4,15,99,0,0]
+        seq = main.AmplifierSequence(program)
+        seq.best_sequence()
+        # One lookup per distinct prefix of the 120 sequences
+        self.assertEqual(seq.cache.hits + seq.cache.misses, 5 + 20 + 60 + 120 + 120)
+        self.assertLess(seq.cache.misses, 5 + 20 + 60 + 120 + 120)
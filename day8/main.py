@@ -1,4 +1,4 @@
-import itertools
+import numpy as np
 
 BLACK = 0
 WHITE = 1
@@ -9,37 +9,115 @@ class Image():
         super().__init__()
         self.width = width
         self.height = height
-        self.layers = self.get_layers([int(x) for x in data])
+        # (layers, height, width) array of colors
+        self.pixels = self.decode(data)
 
-    def get_layers(self, data):
-        layer_len = self.width * self.height
-        return [
-            [x[1] for x in group[1]] for group in
-            itertools.groupby(enumerate(data), key=lambda x: x[0]//layer_len)
-        ]
+    def decode(self, data):
+        pixels = np.frombuffer(data.encode(), dtype=np.uint8) - ord('0')
+        if pixels.size % (self.width * self.height) or (pixels > 9).any():
+            raise Exception("Not a {}x{} image: {!r}".format(self.width, self.height, data[:20]))
+        return pixels.reshape(-1, self.height, self.width)
+
+    @property
+    def layers(self):
+        # Every layer as a flat list of colors
+        return self.pixels.reshape(len(self.pixels), -1).tolist()
+
+    def checksum(self):
+        layers = self.pixels.reshape(len(self.pixels), -1)
+        layer = layers[np.count_nonzero(layers == 0, axis=1).argmin()]
+        return int(np.count_nonzero(layer == 1)) * int(np.count_nonzero(layer == 2))
+
+    def composite(self):
+        # Color of the topmost non transparent layer of every pixel,
+        # transparent if there's none
+        top = (self.pixels != TRANSPARENT).argmax(axis=0)
+        return np.take_along_axis(self.pixels, top[np.newaxis], axis=0)[0]
+
+    def render(self):
+        return render_colors(self.composite())
+
+def render_colors(colors):
+    # Only white is drawn, any other color is a space
+    rows = np.where(colors == WHITE, ord('X'), ord(' ')).astype(np.uint8)
+    newlines = np.full((len(rows), 1), ord("\n"), dtype=np.uint8)
+    return np.hstack([rows, newlines]).tobytes().decode()
+
+def read_layers(source, width, height):
+    # Yields the layers of an image one by one, as (height, width) arrays,
+    # from a path, a binary file or anything supporting the buffer protocol
+    # like bytes or a memory map. The same array is reused for every layer.
+    size = width * height
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from read_layers(f, width, height)
+        return
+    if hasattr(source, 'readinto'):
+        buffer = bytearray(size)
+        chunks = iter(lambda: read_chunk(source, buffer), b'')
+    else:
+        data = memoryview(source)
+        chunks = (data[start:start + size] for start in range(0, len(data), size))
+    layer = np.empty(size, dtype=np.uint8)
+    for chunk in chunks:
+        if len(chunk) < size:
+            if bytes(chunk).strip():
+                raise Exception("Image data isn't a whole number of {}x{} layers".format(width, height))
+            return
+        np.subtract(np.frombuffer(chunk, dtype=np.uint8), ord('0'), out=layer)
+        if (layer > 9).any():
+            raise Exception("Not image data: {!r}".format(bytes(chunk[:20])))
+        yield layer.reshape(height, width)
+
+def read_chunk(f, buffer):
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(buffer):
+        read = f.readinto(view[filled:])
+        if not read:
+            break
+        filled += read
+    return view[:filled] if filled else b''
+
+# Composites layers front to back as they are read, holding one layer at a
+# time. Once every pixel is opaque, reading stops, unless the checksum is
+# wanted too, as it needs every layer: then the remaining layers are only
+# counted.
+class StreamedImage():
+    def __init__(self, width, height, source, checksum=True):
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.colors = np.full((height, width), TRANSPARENT, dtype=np.uint8)
+        self.layers_read = 0
+        self._checksum = None
+        fewest_zeros = None
+        transparent = True
+        for layer in read_layers(source, width, height):
+            self.layers_read += 1
+            if transparent:
+                np.copyto(self.colors, layer, where=self.colors == TRANSPARENT)
+                transparent = (self.colors == TRANSPARENT).any()
+            if checksum:
+                zeros = np.count_nonzero(layer == 0)
+                if fewest_zeros is None or zeros < fewest_zeros:
+                    fewest_zeros = zeros
+                    self._checksum = int(np.count_nonzero(layer == 1)) * int(np.count_nonzero(layer == 2))
+            elif not transparent:
+                break
 
     def checksum(self):
-        layer = min(self.layers, key=lambda layer: layer.count(0))
-        return layer.count(1) * layer.count(2)
+        if self._checksum is None:
+            raise Exception("Checksum wasn't computed")
+        return self._checksum
+
+    def composite(self):
+        return self.colors
 
     def render(self):
-        img = [
-            next(color for color in layers if color != TRANSPARENT) for layers in
-            zip(*self.layers)
-        ]
-        buffer = ""
-        for i, char in enumerate(img):
-            if char == 1:
-                buffer += "X"
-            else:
-                buffer += " "
-            if (i + 1) % self.width == 0:
-                buffer += "\n"
-        return buffer
+        return render_colors(self.colors)
 
 if __name__ == "__main__":
-    with open('input') as f:
-        data = f.read().strip()
-        img = Image(25, 6, data)
-        print("Checksum is: {}".format(img.checksum()))
-        print(img.render())
\ No newline at end of file
+    img = StreamedImage(25, 6, 'input')
+    print("Checksum is: {}".format(img.checksum()))
+    print(img.render())
@@ -1,5 +1,6 @@
+import io
 import unittest
-from main import Image
+from main import Image, StreamedImage
 
 class Tests(unittest.TestCase):
     def test_layers_parse(self):
@@ -8,4 +9,30 @@ class Tests(unittest.TestCase):
         self.assertEqual(img.layers, [
             [1, 2, 3, 4, 5, 6],
             [7, 8, 9, 0, 1, 2]
-        ])
\ No newline at end of file
+        ])
+
+    def test_checksum(self):
+        # Second layer has the fewest zeros
+        img = Image(3, 2, "100200" "112221" "000012")
+        self.assertEqual(img.checksum(), 3 * 3)
+
+    def test_render(self):
+        img = Image(2, 2, "0222112222120000")
+        self.assertEqual(img.render(), " X\nX \n")
+        # Colors other than black, white and transparent are spaces too
+        self.assertEqual(Image(1, 1, "3").render(), " \n")
+        self.assertEqual(StreamedImage(2, 1, b"9221").render(), " X\n")
+
+    def test_streaming(self):
+        data = "0222112222120000"
+        for source in (data.encode() + b"\n", io.BytesIO(data.encode())):
+            img = StreamedImage(2, 2, source)
+            self.assertEqual(img.render(), " X\nX \n")
+            self.assertEqual(img.checksum(), Image(2, 2, data).checksum())
+            self.assertEqual(img.layers_read, 4)
+        # Every pixel is opaque after the second layer
+        img = StreamedImage(2, 2, io.BytesIO(b"012212012222"), checksum=False)
+        self.assertEqual(img.render(), " X\n X\n")
+        self.assertEqual(img.layers_read, 2)
+        with self.assertRaisesRegex(Exception, "whole number of"):
+            StreamedImage(2, 2, b"01201")
@@ -0,0 +1,184 @@
+from collections import namedtuple
+from main import IntcodeV3, OPERANDS
+from compiler import split_instruction, compile_block, WRITE_OPERAND
+
+Instruction = namedtuple('Instruction', 'address op modes args')
+Block = namedtuple('Block', 'start instructions successors')
+
+JUMPS = {5, 6}
+
+# Idioms fused into a single superinstruction, longest first. Each entry lists
+# the opcodes allowed at each position of the sequence.
+PATTERNS = [
+    # Loop counter: bump, compare against the limit, jump back
+    ('counter_loop', ({1}, {7, 8}, {5, 6})),
+    # Function entry: make room on the stack, check the argument, branch
+    ('enter_compare_jump', ({9}, {7, 8}, {5, 6})),
+    # Call: push an argument and the return address, jump
+    ('call', ({1, 2}, {1, 2}, {5, 6})),
+    ('compare_jump', ({7, 8}, {5, 6})),
+    # Return: drop the stack frame, jump to the return address stored in it
+    ('return', ({9}, {5, 6})),
+    # Move relative base, then output relative to it
+    ('base_output', ({9}, {4})),
+]
+
+
+def disassemble(get, entries=(0,)):
+    # Recursive descent from the entry points, following jumps to immediate
+    # targets. Jumps through memory can't be followed, so instructions after
+    # every jump are decoded too, as that's where calls return to.
+    instructions = {}
+    pending = list(entries)
+    while pending:
+        address = pending.pop()
+        while address not in instructions and address >= 0:
+            op, modes = split_instruction(get(address))
+            count = OPERANDS.get(op)
+            if count is None or any(mode not in (0, 1, 2) for mode in modes[:count]):
+                break
+            if op in WRITE_OPERAND and modes[WRITE_OPERAND[op]] == 1:
+                break
+            args = tuple(get(address + 1 + i) for i in range(count))
+            instructions[address] = Instruction(address, op, modes, args)
+            if op == 99:
+                break
+            if op in JUMPS and modes[1] == 1:
+                pending.append(args[1])
+            address += count + 1
+    return instructions
+
+
+def basic_blocks(instructions, entries=(0,)):
+    leaders = set(entries)
+    for instruction in instructions.values():
+        if instruction.op in JUMPS:
+            leaders.add(instruction.address + 3)
+            if instruction.modes[1] == 1:
+                leaders.add(instruction.args[1])
+    blocks = {}
+    for start in sorted(leaders & set(instructions)):
+        body = []
+        address = start
+        while address in instructions and (address == start or address not in leaders):
+            instruction = instructions[address]
+            body.append(instruction)
+            address += OPERANDS[instruction.op] + 1
+            if instruction.op in JUMPS or instruction.op == 99:
+                break
+        last = body[-1]
+        successors = []
+        if last.op in JUMPS:
+            successors.append(last.args[1] if last.modes[1] == 1 else None)
+        if last.op != 99:
+            successors.append(address)
+        blocks[start] = Block(start, body, successors)
+    return blocks
+
+
+def written_addresses(instructions):
+    # Addresses written in position mode, and whether anything else writes
+    # (relative mode), in which case writes can't be pinned down statically
+    constant = set()
+    dynamic = False
+    for instruction in instructions.values():
+        operand = WRITE_OPERAND.get(instruction.op)
+        if operand is None:
+            continue
+        if instruction.modes[operand] == 0:
+            constant.add(instruction.args[operand])
+        else:
+            dynamic = True
+    return constant, dynamic
+
+
+def superinstructions(blocks):
+    for block in blocks.values():
+        position = 0
+        while position < len(block.instructions):
+            for name, pattern in PATTERNS:
+                group = block.instructions[position:position + len(pattern)]
+                if len(group) == len(pattern) and all(i.op in ops for i, ops in zip(group, pattern)):
+                    yield name, group
+                    position += len(pattern)
+                    break
+            else:
+                position += 1
+
+
+def cells(group):
+    start = group[0].address
+    last = group[-1]
+    return range(start, last.address + OPERANDS[last.op] + 1)
+
+
+# Interpreter that fuses common instruction sequences into superinstructions.
+#
+# Superinstructions are put into the decoded instruction cache, so `tick`
+# dispatches a whole sequence at once. Sequences overlapping an address the
+# program writes to in position mode are never fused. Relative mode writes
+# can't be checked statically, so every fused sequence is also guarded at run
+# time: writing into any of its cells drops it, and the plain instructions
+# are decoded again.
+class OptimizedIntcodeV3(IntcodeV3):
+    def __init__(self, memory):
+        super().__init__(memory)
+        # address -> start of the superinstruction covering it
+        self._fused = {}
+        # start of a superinstruction -> addresses it covers
+        self._regions = {}
+        self.optimize()
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self._fused = {}
+        self._regions = {}
+        self.optimize()
+
+    def optimize(self):
+        # Code is read straight from memory, so a `Profiler` doesn't count it as data reads
+        instructions = disassemble(self.memory.__getitem__)
+        self.blocks = basic_blocks(instructions)
+        written, dynamic = written_addresses(instructions)
+        self.report = []
+        for name, group in superinstructions(self.blocks):
+            region = cells(group)
+            if written.intersection(region):
+                continue
+            self.fuse(group)
+            self.report.append({
+                'pattern': name,
+                'start': region.start,
+                'end': region.stop,
+                'proven': not dynamic,
+            })
+        return self.report
+
+    def fuse(self, group):
+        start = group[0].address
+        region = cells(group)
+        block = compile_block(start, tuple(self.memory[address] for address in region))
+        fused = self._fused
+
+        def superinstruction(modes):
+            # Methods are looked up on every run, so hooks set on the machine,
+            # like the ones of `Profiler`, see what the superinstruction does
+            self.cursor = block(self, self.get, self.set_memory, self.output, self.pop_input, fused)
+            return False
+
+        # In place of the modes, the (opcode, address) of every instruction it stands for
+        sites = tuple((instruction.op, instruction.address) for instruction in group)
+        self._decoded[start] = (None, superinstruction, sites, len(region) - 1)
+        self._regions[start] = region
+        for address in region:
+            self._fused[address] = start
+
+    def set_memory(self, pos, val):
+        super().set_memory(pos, val)
+        if pos in self._fused:
+            self.unfuse(self._fused[pos])
+
+    def unfuse(self, start):
+        self._decoded.pop(start, None)
+        for address in self._regions.pop(start):
+            del self._fused[address]
@@ -0,0 +1,155 @@
+import numpy as np
+from main import IntcodeV3, OPERANDS
+
+MAX_COLUMNS = 1 << 16
+# Operands below this in absolute value can be added without leaving int64
+SAFE_OPERAND = 1 << 62
+WRITE_OPERAND = {1: 2, 2: 2, 3: 0, 7: 2, 8: 2}
+
+
+# Runs the same program on many inputs at once. Memories of all machines are
+# rows of one int64 array, and on every step machines about to run the same
+# instruction word are executed together with vectorized gathers and scatters.
+# A machine that needs anything the batch can't do (values outside of int64,
+# far away or negative addresses, unknown instructions, missing input) is
+# peeled off into a regular `IntcodeV3` and finishes there.
+class BatchIntcode():
+    def __init__(self, program, count):
+        super().__init__()
+        self.program = program
+        self.count = count
+        self.cursor = np.zeros(count, dtype=np.int64)
+        self.relative_base = np.zeros(count, dtype=np.int64)
+        self.running = np.ones(count, dtype=bool)
+        self.inputs = [[] for _ in range(count)]
+        self.outputs = [[] for _ in range(count)]
+        self.scalar = {}
+        try:
+            row = np.array(program or [0], dtype=np.int64)
+        except OverflowError:
+            row = np.zeros(1, dtype=np.int64)
+            self.running[:] = False
+            for i in range(count):
+                machine = self.scalar[i] = IntcodeV3(list(program))
+                machine._output = self.outputs[i]
+        self.memory = np.tile(row, (count, 1))
+
+    def run(self, inputs):
+        # `inputs[i]` is what `IntcodeV3.run` of the i-th machine would get
+        for i, input in enumerate(inputs):
+            self.inputs[i] = input
+        while self.step():
+            pass
+        for i, machine in self.scalar.items():
+            machine.run(self.inputs[i])
+        return True
+
+    def get_outputs(self):
+        return self.outputs
+
+    def step(self):
+        active = np.flatnonzero(self.running)
+        if not active.size:
+            return False
+        ips = self.cursor[active]
+        ok = self.fit(ips + 3)
+        if not ok.all():
+            self.peel(active[~ok])
+            active, ips = active[ok], ips[ok]
+        words = self.memory[active, ips]
+        for word in np.unique(words):
+            group = words == word
+            self.execute(int(word), active[group], ips[group])
+        return True
+
+    def fit(self, addresses):
+        ok = (addresses >= 0) & (addresses < MAX_COLUMNS)
+        if ok.any():
+            needed = int(addresses[ok].max()) + 1
+            if needed > self.memory.shape[1]:
+                columns = min(max(needed, 2 * self.memory.shape[1]), MAX_COLUMNS)
+                grown = np.zeros((self.count, columns), dtype=np.int64)
+                grown[:, :self.memory.shape[1]] = self.memory
+                self.memory = grown
+        return ok
+
+    def peel(self, idx):
+        for i in idx.tolist():
+            machine = IntcodeV3(self.memory[i].tolist())
+            machine.cursor = int(self.cursor[i])
+            machine.relative_base = int(self.relative_base[i])
+            machine._output = self.outputs[i]
+            self.scalar[i] = machine
+            self.running[i] = False
+
+    def execute(self, word, idx, ip):
+        encoded_modes, op = divmod(word, 100)
+        modes = (encoded_modes % 10, encoded_modes // 10 % 10, encoded_modes // 100 % 10)
+        count = OPERANDS.get(op)
+        if count is None or any(mode not in (0, 1, 2) for mode in modes[:count]) or \
+                (op in WRITE_OPERAND and modes[WRITE_OPERAND[op]] == 1):
+            self.peel(idx)
+            return
+        raw = [self.memory[idx, ip + 1 + k] for k in range(count)]
+        addresses = [
+            None if mode == 1 else value + self.relative_base[idx] if mode == 2 else value
+            for value, mode in zip(raw, modes)
+        ]
+        ok = np.ones(len(idx), dtype=bool)
+        for address in addresses:
+            if address is not None:
+                ok &= self.fit(address)
+        if op in (1, 2):
+            values = [self.read(idx, raw[k], addresses[k], ok) for k in range(2)]
+            if op == 1:
+                ok &= (np.abs(values[0]) < SAFE_OPERAND) & (np.abs(values[1]) < SAFE_OPERAND)
+            else:
+                ok &= np.abs(values[0].astype(float) * values[1].astype(float)) < 2.0 ** 62
+        if op == 3:
+            ok &= np.array([len(self.inputs[i]) > 0 for i in idx.tolist()], dtype=bool)
+        if not ok.all():
+            self.peel(idx[~ok])
+            idx, ip = idx[ok], ip[ok]
+            raw = [value[ok] for value in raw]
+            addresses = [None if address is None else address[ok] for address in addresses]
+            if not idx.size:
+                return
+        values = [self.read(idx, r, a) for r, a in zip(raw, addresses)]
+        memory = self.memory
+        if op == 1:
+            memory[idx, addresses[2]] = values[0] + values[1]
+        elif op == 2:
+            memory[idx, addresses[2]] = values[0] * values[1]
+        elif op == 7:
+            memory[idx, addresses[2]] = values[0] < values[1]
+        elif op == 8:
+            memory[idx, addresses[2]] = values[0] == values[1]
+        elif op == 3:
+            memory[idx, addresses[0]] = [self.inputs[i].pop() for i in idx.tolist()]
+        elif op == 4:
+            for i, value in zip(idx.tolist(), values[0].tolist()):
+                self.outputs[i].append(value)
+        elif op == 9:
+            self.relative_base[idx] += values[0]
+        elif op == 99:
+            self.running[idx] = False
+        if op == 5:
+            self.cursor[idx] = np.where(values[0] != 0, values[1], ip + 3)
+        elif op == 6:
+            self.cursor[idx] = np.where(values[0] == 0, values[1], ip + 3)
+        else:
+            self.cursor[idx] = ip + 1 + count
+
+    def read(self, idx, raw, address, ok=None):
+        if address is None:
+            return raw
+        if ok is not None:
+            # Addresses that didn't fit are peeled later, read something harmless for them
+            address = np.where(ok, address, 0)
+        return self.memory[idx, address]
+
+
+def run_batch(program, inputs):
+    batch = BatchIntcode(program, len(inputs))
+    batch.run(inputs)
+    return batch.get_outputs()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from array import array
+from main import IntcodeV3
+
+# Eviction goes down to this share of `size`, so the directory is scanned once
+# every few puts rather than on each of them
+LOW_WATER = 0.9
+# Temporary files older than this, in seconds, were left by a writer that died
+STALE_TEMPORARY = 3600
+
+def digest_numbers(digest, values):
+    try:
+        encoded = b'q' + array('q', values).tobytes()
+    except OverflowError:
+        # Some value is out of int64
+        encoded = b'r' + repr(list(values)).encode()
+    digest.update(len(encoded).to_bytes(8, 'little'))
+    digest.update(encoded)
+
+
+def engine_version(engine):
+    return "{}.{}:{}".format(engine.__module__, engine.__qualname__, engine.version)
+
+
+# Outputs of finished runs on disk, one file per (program, engine version,
+# input), named after the hash of the three. Files are written to a temporary
+# name and renamed into place, so any number of processes can share a
+# directory: readers see either the whole entry or none. A hit bumps the
+# modification time of its file, and once there are more than `size` entries
+# the least recently used ones are removed. Entries are counted as they're
+# put, and only recounted when evicting, which also catches entries put by
+# other processes.
+class ResultCache():
+    def __init__(self, directory, size=10000):
+        super().__init__()
+        self.directory = directory
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.count = sum(1 for entry in os.scandir(directory) if entry.name.endswith('.json'))
+
+    def key(self, program, engine, input):
+        digest = hashlib.sha256()
+        digest_numbers(digest, program)
+        digest.update(engine_version(engine).encode())
+        digest_numbers(digest, input)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            # Missing, or evicted by another process meanwhile
+            self.misses += 1
+            return None
+        self.touch(path)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(result, f)
+        if not os.path.exists(path):
+            self.count += 1
+        os.replace(temporary, path)
+        self.touch(path)
+        if self.count > self.size:
+            self.evict()
+
+    def touch(self, path):
+        # File system clocks may tick far too rarely to order entries by use
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            # Evicted by another process meanwhile
+            pass
+
+    def evict(self):
+        entries = []
+        stale = time.time() - STALE_TEMPORARY
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.json'):
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+                elif entry.name.endswith('.tmp') and entry.stat().st_mtime < stale:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        keep = int(self.size * LOW_WATER)
+        entries.sort()
+        for _, path in entries[:max(len(entries) - keep, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.count = min(len(entries), keep)
+
+    def run(self, program, input, engine=IntcodeV3):
+        # Output of `engine(program).run(input)`, run only if it isn't cached yet
+        key = self.key(program, engine, input)
+        result = self.get(key)
+        if result is None:
+            computer = engine(list(program))
+            computer.run(list(input))
+            result = {'output': computer.get_output()}
+            self.put(key, result)
+        return result['output']
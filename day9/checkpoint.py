@@ -0,0 +1,129 @@
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from main import IntcodeV3, PagedMemory
+from image import BIG_NUMBER, INT64
+
+# Checkpoint layout, all little-endian:
+#   header: magic, version, hash of the program, cursor, relative base
+#   four number lists: addresses and values of every cell that differs from
+#   the program, pending input and unread output
+# A number list is its length and the number of values out of int64, one int64
+# per value, 0 in place of values out of int64, then index, length and decimal
+# digits of each of those.
+MAGIC = b'ICK\0'
+VERSION = 1
+HEADER = struct.Struct('<4sI20sQq')
+NUMBERS = struct.Struct('<QQ')
+
+
+def program_hash(program):
+    return hashlib.sha1(repr(list(program)).encode()).digest()
+
+
+def write_numbers(f, values):
+    cells = array('q')
+    big = []
+    for index, value in enumerate(values):
+        if value in INT64:
+            cells.append(value)
+        else:
+            cells.append(0)
+            big.append((index, value))
+    if sys.byteorder != 'little':
+        cells.byteswap()
+    f.write(NUMBERS.pack(len(cells), len(big)))
+    f.write(cells.tobytes())
+    for index, value in big:
+        digits = str(value).encode()
+        f.write(BIG_NUMBER.pack(index, len(digits)))
+        f.write(digits)
+
+
+def read_numbers(f):
+    count, big = NUMBERS.unpack(f.read(NUMBERS.size))
+    cells = array('q', f.read(8 * count))
+    if sys.byteorder != 'little':
+        cells.byteswap()
+    values = cells.tolist()
+    for _ in range(big):
+        index, length = BIG_NUMBER.unpack(f.read(BIG_NUMBER.size))
+        values[index] = int(f.read(length).decode())
+    return values
+
+
+# Saves `IntcodeV3` machines running `program` (a list or a `ProgramImage`) to
+# `path` and resumes them, in this process or any other. Only cells that differ
+# from the program are saved. Checkpoints are written to a temporary file and
+# renamed over the previous one, so a crash never leaves a torn checkpoint.
+class Checkpointer():
+    def __init__(self, program, path, every=100000):
+        super().__init__()
+        self.path = path
+        self.every = every
+        if isinstance(program, list):
+            self.base = PagedMemory(program)
+        else:
+            self.base = program.memory()
+            program = program.to_list()
+        self.hash = program_hash(program)
+
+    def save(self, machine):
+        # Pages still shared with the program can't differ from it, and aren't compared
+        changes = list(machine.memory.differences(self.base))
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.hash, machine.cursor, machine.relative_base))
+            write_numbers(f, [address for address, _ in changes])
+            write_numbers(f, [value for _, value in changes])
+            write_numbers(f, list(machine._input))
+            write_numbers(f, list(machine.get_output()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self, engine=IntcodeV3):
+        with open(self.path, 'rb') as f:
+            magic, version, hash, cursor, relative_base = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise Exception("Not an Intcode checkpoint: {}".format(self.path))
+            if hash != self.hash:
+                raise Exception("Checkpoint {} is of another program".format(self.path))
+            addresses = read_numbers(f)
+            values = read_numbers(f)
+            input = read_numbers(f)
+            output = read_numbers(f)
+        memory = self.base.fork()
+        for address, value in zip(addresses, values):
+            memory[address] = value
+        machine = engine(memory)
+        machine.cursor = cursor
+        machine.relative_base = relative_base
+        machine._input = input
+        machine._output = output
+        return machine
+
+    def run(self, machine, input=None):
+        # Like `machine.run`, saving a checkpoint every `every` instructions and on halt
+        if input is not None:
+            machine._input = input
+        tick = machine.tick
+        res = False
+        while not res:
+            for _ in range(self.every):
+                res = tick()
+                if res:
+                    break
+            self.save(machine)
+        return res
+
+    def resume(self, engine=IntcodeV3):
+        # Picks up from the last checkpoint and runs to the end
+        machine = self.load(engine)
+        self.run(machine)
+        return machine
@@ -0,0 +1,214 @@
+import functools
+from main import IntcodeV3, OPERANDS
+
+MAX_BLOCK_INSTRUCTIONS = 64
+# Blocks are compiled once their start was reached this many times, so code
+# that runs once or twice doesn't pay for compilation
+HOT_ENTRIES = 8
+# Addresses whose block was thrown away more often than this are left to the interpreter
+MAX_DEOPTIMIZATIONS = 3
+BLOCK_TERMINATORS = {5, 6, 99}
+WRITE_OPERAND = {1: 2, 2: 2, 3: 0, 7: 2, 8: 2}
+
+
+def split_instruction(instruction):
+    encoded_modes, op = divmod(instruction, 100)
+    return op, (encoded_modes % 10, encoded_modes // 10 % 10, encoded_modes // 100 % 10)
+
+
+def read_block(get, start):
+    # Collects the memory cells of a straight-line block starting at `start`.
+    # Stops after a jump or a halt, and before anything the compiler can't
+    # handle, so that the interpreter deals with it (and raises the same errors)
+    cells = []
+    address = start
+    for _ in range(MAX_BLOCK_INSTRUCTIONS):
+        op, modes = split_instruction(get(address))
+        if op not in OPERANDS:
+            break
+        count = OPERANDS[op]
+        if any(mode not in (0, 1, 2) for mode in modes[:count]):
+            break
+        if op in WRITE_OPERAND and modes[WRITE_OPERAND[op]] == 1:
+            break
+        cells.extend(get(address + i) for i in range(count + 1))
+        address += count + 1
+        if op in BLOCK_TERMINATORS:
+            break
+    return tuple(cells)
+
+
+def read_expression(operand, mode):
+    if mode == 0:
+        return "get({})".format(operand)
+    if mode == 1:
+        return str(operand)
+    return "get(rb + {})".format(operand)
+
+
+def write_expression(operand, mode):
+    if mode == 0:
+        return str(operand)
+    return "rb + {}".format(operand)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_block(start, cells):
+    # Turns a block into a Python function. Blocks are cached by their content,
+    # so many machines running the same program share the compiled code.
+    #
+    # The function returns an address to continue from, or None on halt.
+    # After every write it checks whether compiled code was overwritten, and if
+    # so leaves the block right away, so the rest of it is never run stale.
+    # Before every instruction that may raise, like an input running out, it
+    # keeps the instruction's address in `pc`: if it raises, the machine is
+    # left at that instruction, so running it again picks up from there
+    # without repeating what the block already did.
+    lines = [
+        "def block(machine, get, set_memory, output, pop_input, code):",
+        "    rb = machine.relative_base",
+        "    pc = {}".format(start),
+        "    try:",
+    ]
+
+    def leave(indent, address):
+        lines.append(indent + "machine.relative_base = rb")
+        lines.append(indent + "return {}".format(address))
+
+    def write(target, value, next_address):
+        lines.append("    a = {}".format(target))
+        lines.append("    hit = a in code")
+        lines.append("    set_memory(a, {})".format(value))
+        lines.append("    if hit:")
+        leave("        ", next_address)
+
+    position = 0
+    address = start
+    while position < len(cells):
+        op, modes = split_instruction(cells[position])
+        count = OPERANDS[op]
+        args = cells[position + 1:position + 1 + count]
+        if op in (1, 2, 3, 4, 7, 8) and address != start:
+            lines.append("    pc = {}".format(address))
+        position += count + 1
+        address += count + 1
+        if op in (1, 2, 7, 8):
+            left = read_expression(args[0], modes[0])
+            right = read_expression(args[1], modes[1])
+            value = {
+                1: "{} + {}",
+                2: "{} * {}",
+                7: "1 if {} < {} else 0",
+                8: "1 if {} == {} else 0",
+            }[op].format(left, right)
+            write(write_expression(args[2], modes[2]), value, address)
+        elif op == 3:
+            write(write_expression(args[0], modes[0]), "pop_input()", address)
+        elif op == 4:
+            lines.append("    output({})".format(read_expression(args[0], modes[0])))
+        elif op == 9:
+            lines.append("    rb += {}".format(read_expression(args[0], modes[0])))
+        elif op in (5, 6):
+            condition = "!=" if op == 5 else "=="
+            lines.append("    if {} {} 0:".format(read_expression(args[0], modes[0]), condition))
+            leave("        ", read_expression(args[1], modes[1]))
+        elif op == 99:
+            lines.append("    machine.cursor = {}".format(address))
+            leave("    ", None)
+            break
+    else:
+        leave("    ", address)
+    # Everything so far goes in the `try`
+    lines[4:] = ["    " + line for line in lines[4:]]
+    lines.extend([
+        "    except BaseException:",
+        "        machine.cursor = pc",
+        "        machine.relative_base = rb",
+        "        raise",
+    ])
+    namespace = {}
+    exec(compile("\n".join(lines), "<intcode block {}>".format(start), "exec"), namespace)
+    block = namespace["block"]
+    block.size = len(cells)
+    return block
+
+
+class CompiledIntcodeV3(IntcodeV3):
+    hot_entries = HOT_ENTRIES
+
+    def __init__(self, memory):
+        super().__init__(memory)
+        # block start -> compiled block
+        self._blocks = {}
+        # address -> starts of compiled blocks covering it
+        self._code = {}
+        # address -> times it was reached without a compiled block
+        self._entries = {}
+        # block start -> times its block was thrown away
+        self._deoptimizations = {}
+
+    def run(self, input=None):
+        if input is not None:
+            self._input = input
+        blocks = self._blocks
+        run_block = self.run_block
+        args = (self, self.get, self.set_memory, self.output, self.pop_input, self._code)
+        while True:
+            block = blocks.get(self.cursor)
+            if block is None:
+                block = self.compile(self.cursor)
+            if block is None:
+                res = self.tick()
+                if res:
+                    return res
+                continue
+            if run_block(block, args):
+                return True
+
+    def run_block(self, block, args):
+        # Returns True if the block halted the machine
+        address = block(*args)
+        if address is None:
+            return True
+        self.cursor = address
+        return False
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self._blocks = {}
+        self._code = {}
+        self._entries = {}
+        self._deoptimizations = {}
+
+    def compile(self, start):
+        entries = self._entries[start] = self._entries.get(start, 0) + 1
+        if entries < self.hot_entries or self._deoptimizations.get(start, 0) > MAX_DEOPTIMIZATIONS:
+            return None
+        # Code is read straight from memory, so a `Profiler` doesn't count it as data reads
+        cells = read_block(self.memory.__getitem__, start)
+        if not cells:
+            return None
+        block = compile_block(start, cells)
+        self._blocks[start] = block
+        for address in range(start, start + len(cells)):
+            self._code.setdefault(address, set()).add(start)
+        return block
+
+    def set_memory(self, pos, val):
+        super().set_memory(pos, val)
+        if pos in self._code:
+            self.deoptimize(pos)
+
+    def deoptimize(self, pos):
+        for start in self._code.pop(pos):
+            block = self._blocks.pop(start, None)
+            if block is None:
+                continue
+            self._entries[start] = 0
+            self._deoptimizations[start] = self._deoptimizations.get(start, 0) + 1
+            for address in range(start, start + block.size):
+                starts = self._code.get(address)
+                if starts is not None:
+                    starts.discard(start)
+                    if not starts:
+                        del self._code[address]
@@ -0,0 +1,166 @@
+from main import IntcodeV3
+
+HOOKS = ('tick', 'set_memory', 'output', 'pop_input')
+HASH_MASK = (1 << 64) - 1
+
+
+def cell_hash(position, value):
+    # Zero cells hash to 0, so untouched memory needs no hashing at all
+    return hash((position, value)) & HASH_MASK if value else 0
+
+
+def same_memory(left, right):
+    return next(left.differences(right), None) is None
+
+
+class CycleDetected(Exception):
+    def __init__(self, address, period):
+        super().__init__("Infinite loop at {}, repeating every {} instructions".format(address, period))
+        self.address = address
+        self.period = period
+
+
+# A plain interpreter started from a state a detector went through, with the
+# hash of its memory kept up to date, to walk a cycle one instruction at a time
+class Replay():
+    def __init__(self, memory, cursor, relative_base, memory_hash):
+        super().__init__()
+        self.machine = IntcodeV3.from_snapshot({
+            'memory': memory,
+            'cursor': cursor,
+            'relative_base': relative_base,
+            'input': [],
+            'output': [],
+        })
+        self.memory_hash = memory_hash
+        self._set_memory = self.machine.set_memory
+        self.machine.set_memory = self.set_memory
+
+    def state(self):
+        return self.memory_hash, self.machine.cursor, self.machine.relative_base
+
+    def same(self, other):
+        return self.state() == other.state() and same_memory(self.machine.memory, other.machine.memory)
+
+    def step(self):
+        if self.machine.tick():
+            # The detector only goes through states that don't do input or output
+            raise Exception("Replay left the cycle at {}".format(self.machine.cursor))
+
+    def set_memory(self, pos, val):
+        self.memory_hash ^= cell_hash(pos, self.machine.memory[pos]) ^ cell_hash(pos, val)
+        return self._set_memory(pos, val)
+
+
+# Raises `CycleDetected` from a machine that went back to an earlier state
+# without reading input or writing output, so it would loop forever.
+#
+# Memory is hashed once, then the hash is updated on every write. Cycles are
+# searched with Brent's algorithm: a state is marked at every power of two
+# steps since the last input or output, and the first later state with the
+# same hash, cursor and relative base is compared with the marked one cell by
+# cell, so a reported cycle is never a hash collision. The second phase is
+# replayed from the first marked state with `Replay`, one instruction at a
+# time, so `address` is the cursor of the first state on the cycle and
+# `period` its length in instructions, whatever a step is on the machine.
+#
+# Hooks are set as attributes of the machine, like `Profiler` does, wrapping
+# whatever the machine had, so both can be attached in any order; they are
+# detached in reverse order. On `CompiledIntcodeV3`, every compiled block run
+# is one step.
+class CycleDetector():
+    def __init__(self, machine):
+        super().__init__()
+        self.machine = machine
+        self.memory_hash = 0
+        for start, cells in machine.memory.chunks():
+            for offset, value in enumerate(cells):
+                self.memory_hash ^= cell_hash(start + offset, value)
+        self.steps = 0
+        self.reset()
+        self.hooks = HOOKS
+        if hasattr(machine, 'run_block'):
+            self.hooks += ('run_block',)
+        self.shadowed = {name: machine.__dict__[name] for name in self.hooks if name in machine.__dict__}
+        for name in self.hooks:
+            setattr(self, '_' + name, getattr(machine, name))
+            setattr(machine, name, getattr(self, name))
+
+    def detach(self):
+        for name in self.hooks:
+            if name in self.shadowed:
+                setattr(self.machine, name, self.shadowed[name])
+            else:
+                del self.machine.__dict__[name]
+
+    def reset(self):
+        self.mark = None
+        self.marked_memory = None
+        self.origin = None
+        self.interval = 1
+        self.since = 0
+
+    def state(self):
+        return self.memory_hash, self.machine.cursor, self.machine.relative_base
+
+    def tick(self):
+        res = self._tick()
+        if res and res is not True:
+            # Starved for input: the instruction will be retried, it didn't run
+            return res
+        self.step()
+        return res
+
+    def run_block(self, block, args):
+        halted = self._run_block(block, args)
+        self.step()
+        return halted
+
+    def step(self):
+        self.steps += 1
+        self.since += 1
+        state = self.state()
+        if state == self.mark and same_memory(self.machine.memory, self.marked_memory):
+            raise CycleDetected(*self.entry())
+        if self.since == self.interval:
+            self.mark = state
+            self.marked_memory = self.machine.copy_memory(self.machine.memory)
+            if self.origin is None:
+                self.origin = (self.marked_memory, self.machine.cursor, self.machine.relative_base, self.memory_hash)
+            self.interval *= 2
+            self.since = 0
+
+    def entry(self):
+        # Brent's second phase: the period, walking the cycle from here, then a
+        # replay from the origin and one a period ahead of it, in lockstep
+        # until they meet on the first state of the cycle
+        machine = self.machine
+        here = Replay(machine.memory, machine.cursor, machine.relative_base, self.memory_hash)
+        probe = Replay(machine.memory, machine.cursor, machine.relative_base, self.memory_hash)
+        period = 0
+        while True:
+            probe.step()
+            period += 1
+            if probe.same(here):
+                break
+        tortoise = Replay(*self.origin)
+        hare = Replay(*self.origin)
+        for _ in range(period):
+            hare.step()
+        while not tortoise.same(hare):
+            tortoise.step()
+            hare.step()
+        return tortoise.machine.cursor, period
+
+    def set_memory(self, pos, val):
+        self.memory_hash ^= cell_hash(pos, self.machine.memory[pos]) ^ cell_hash(pos, val)
+        return self._set_memory(pos, val)
+
+    def output(self, val):
+        self.reset()
+        return self._output(val)
+
+    def pop_input(self):
+        val = self._pop_input()
+        self.reset()
+        return val
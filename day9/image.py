@@ -0,0 +1,92 @@
+import mmap
+import struct
+import sys
+from array import array
+from main import PagedMemory, PAGE_BITS, PAGE_MASK, PAGE_SIZE
+
+# Program image layout, all little-endian:
+#   header: magic, version, number of cells, number of big numbers
+#   cells: one int64 per memory cell, 0 in place of big numbers
+#   big numbers: address, length and decimal digits of every value out of int64
+# The header is 24 bytes long, so cells stay 8-byte aligned.
+MAGIC = b'ICP\0'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ')
+BIG_NUMBER = struct.Struct('<QI')
+INT64 = range(-2 ** 63, 2 ** 63)
+
+
+def write(program, path):
+    cells = array('q')
+    big = []
+    for address, value in enumerate(program):
+        if value in INT64:
+            cells.append(value)
+        else:
+            cells.append(0)
+            big.append((address, value))
+    if sys.byteorder != 'little':
+        cells.byteswap()
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(cells), len(big)))
+        f.write(cells.tobytes())
+        for address, value in big:
+            digits = str(value).encode()
+            f.write(BIG_NUMBER.pack(address, len(digits)))
+            f.write(digits)
+
+
+def convert(text_path, image_path):
+    with open(text_path) as f:
+        write([int(x) for x in f.read().strip().split(',')], image_path)
+
+
+# Read-only program memory-mapped from an image. Machines get views into the
+# mapping as the pages of their program range, and copy a page only when they
+# write into it, so any number of machines, in any number of processes, share
+# one copy of the program.
+class ProgramImage():
+    def __init__(self, path):
+        super().__init__()
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, big = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Not an Intcode program image: {}".format(path))
+        end = HEADER.size + 8 * count
+        if sys.byteorder == 'little':
+            self.cells = memoryview(self._map)[HEADER.size:end].cast('q')
+        else:
+            self.cells = array('q', self._map[HEADER.size:end])
+            self.cells.byteswap()
+        self.big = {}
+        for _ in range(big):
+            address, length = BIG_NUMBER.unpack_from(self._map, end)
+            end += BIG_NUMBER.size
+            self.big[address] = int(self._map[end:end + length].decode())
+            end += length
+        self.pages = [self.cells[start:start + PAGE_SIZE] for start in range(0, count, PAGE_SIZE)]
+        # Pages with big numbers are patched, in a copy
+        for address, value in self.big.items():
+            number = address >> PAGE_BITS
+            if not isinstance(self.pages[number], list):
+                self.pages[number] = self.pages[number].tolist()
+            self.pages[number][address & PAGE_MASK] = value
+
+    def __len__(self):
+        return len(self.cells)
+
+    def to_list(self):
+        program = self.cells.tolist()
+        for address, value in self.big.items():
+            program[address] = value
+        return program
+
+    def memory(self):
+        memory = PagedMemory()
+        memory.low = list(self.pages)
+        return memory
+
+
+if __name__ == "__main__":
+    convert(sys.argv[1], sys.argv[2])
@@ -1,6 +1,63 @@
 import itertools
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from array import array
 
+OPERANDS = {
+    1: 3,
+    2: 3,
+    3: 1,
+    4: 1,
+    5: 2,
+    6: 2,
+    7: 3,
+    8: 3,
+    9: 1,
+    99: 0,
+}
+
+# Yielded by `Intcode.stream` when the machine waits for more input
+STARVED = object()
+
+class InputStarved(Exception):
+    pass
+
+# Input read front to back, from a deque the caller may keep filling, from a
+# list, or lazily from any other iterable. Stands in for the reversed input list.
+class InputStream():
+    def __init__(self, source=()):
+        super().__init__()
+        if isinstance(source, deque):
+            self.pending, self.source = source, iter(())
+        elif hasattr(source, '__len__'):
+            # Nothing to gain from reading a list lazily, and a snapshot
+            # can then hold all of it
+            self.pending, self.source = deque(source), iter(())
+        else:
+            self.pending, self.source = deque(), iter(source)
+
+    def __len__(self):
+        if not self.pending:
+            self.pending.extend(itertools.islice(self.source, 1))
+        return len(self.pending)
+
+    def pop(self):
+        if not len(self):
+            raise InputStarved()
+        return self.pending.popleft()
+
+    def push(self, value):
+        self.pending.append(value)
+
+    def __iter__(self):
+        # Values left to read, last to be read first, like the input lists
+        # machines pop from the end, so snapshots and checkpoints store them
+        # as such. Values a lazy source hasn't produced yet aren't included.
+        return reversed(self.pending)
+
+# Machines aren't thread-safe: each one must be run by a single thread at a
+# time. Separate machines share no mutable state, even when forked from the
+# same machine or snapshot, so they can run on separate threads.
 class Intcode():
     def __init__(self, memory):
         self.memory = memory
@@ -14,6 +71,10 @@ class Intcode():
             4: self.output_instruction,
             99: self.exit_instruction
         }
+        # address -> (op, handler, modes, operands count)
+        self._decoded = {}
+        # instruction -> the same, shared by every address holding it
+        self._decodings = {}
         super().__init__()
 
     def run(self, input=None):
@@ -24,6 +85,36 @@ class Intcode():
             res = self.tick()
         return res
 
+    def stream(self, input=()):
+        # Yields outputs as soon as they are produced. When input runs out,
+        # yields `STARVED` and retries once resumed; the missing input can be
+        # appended to the `input` deque or passed in with `send()`.
+        self._input = input = InputStream(input)
+        output = self._output
+        # Outputs from before streaming started, like the ones of ticks run
+        # by hand or of a restored snapshot, come first
+        while output:
+            sent = yield output.pop(0)
+            if sent is not None:
+                input.push(sent)
+        while True:
+            cursor = self.cursor
+            try:
+                res = self.tick()
+            except InputStarved:
+                self.cursor = cursor
+                res = STARVED
+            if output:
+                sent = yield output.pop()
+                if sent is not None:
+                    input.push(sent)
+            if res is True:
+                return
+            if res:
+                sent = yield STARVED
+                if sent is not None:
+                    input.push(sent)
+
     def output(self, val):
         self._output.append(val)
 
@@ -35,45 +126,88 @@ class Intcode():
 
     def set_memory(self, pos, val):
         self.memory[pos] = val
+        if pos in self._decoded:
+            # Self-modifying code rewrote an instruction we've already decoded
+            del self._decoded[pos]
 
     def get(self, position):
         return self.memory[position]
 
+    def copy_memory(self, memory):
+        return memory[:]
+
+    def snapshot(self):
+        return {
+            'memory': self.copy_memory(self.memory),
+            'cursor': self.cursor,
+            'input': list(self._input),
+            'output': list(self._output),
+        }
+
+    def restore(self, snapshot):
+        # Snapshot stays untouched, so it can be restored any number of times
+        self.memory = self.copy_memory(snapshot['memory'])
+        self.cursor = snapshot['cursor']
+        self._input = list(snapshot['input'])
+        self._output = list(snapshot['output'])
+        self._decoded = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        machine = cls([])
+        machine.restore(snapshot)
+        return machine
+
+    def fork(self):
+        return self.from_snapshot(self.snapshot())
+
     def pop(self):
         val = self.memory[self.cursor]
         self.cursor += 1
         return val
 
     def pop_instruction(self):
-        instruction = self.pop()
+        address = self.cursor
+        decoded = self._decoded.get(address)
+        if decoded is None:
+            decoded = self.decode(self.pop())
+            self._decoded[address] = decoded
+        else:
+            self.cursor += 1
+        return decoded
+
+    def decode(self, instruction):
+        decoded = self._decodings.get(instruction)
+        if decoded is not None:
+            return decoded
         encoded_modes, op = divmod(instruction, 100)
-        modes = {i: int(x) for i, x in enumerate(reversed(str(encoded_modes)))}
-        return op, modes
+        handler = self.instructions.get(op)
+        if handler is None:
+            raise Exception("Unknown instruction: {}".format(op))
+        modes = (encoded_modes % 10, encoded_modes // 10 % 10, encoded_modes // 100 % 10)
+        decoded = self._decodings[instruction] = op, handler, modes, OPERANDS[op]
+        return decoded
 
     def tick(self):
-        instruction, modes = self.pop_instruction()
-        handler = self.instructions.get(instruction)
-        if handler is not None:
-            return handler(modes)
-        else:
-            raise Exception("Unknown instruction: {}".format(instruction))
+        _, handler, modes, _ = self.pop_instruction()
+        return handler(modes)
 
     def sum_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
-        output_position = self.output_position(self.pop(), modes.pop(2, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
+        output_position = self.output_position(self.pop(), modes[2])
         self.set_memory(output_position, left + right)
         return False
 
     def multiplication_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
-        output_position = self.output_position(self.pop(), modes.pop(2, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
+        output_position = self.output_position(self.pop(), modes[2])
         self.set_memory(output_position, left * right)
         return False
 
     def input_instruction(self, modes):
-        output_position = self.output_position(self.pop(), modes.pop(0, 0))
+        output_position = self.output_position(self.pop(), modes[0])
         val = self.pop_input()
         self.set_memory(output_position, val)
         return False
@@ -84,7 +218,7 @@ class Intcode():
         raise AssertionError("Immediate mode for output?")
 
     def output_instruction(self, modes):
-        val = self.get_arg(self.pop(), modes.pop(0, 0))
+        val = self.get_arg(self.pop(), modes[0])
         self.output(val)
         return False
 
@@ -115,45 +249,210 @@ class Jumper(Intcode):
         self.cursor = pointer
 
     def jump_if_true_instruction(self, modes):
-        condition = self.get_arg(self.pop(), modes.pop(0, 0))
-        pointer = self.get_arg(self.pop(), modes.pop(1, 0))
+        condition = self.get_arg(self.pop(), modes[0])
+        pointer = self.get_arg(self.pop(), modes[1])
         if condition != 0:
             self.set_cursor(pointer)
 
     def jump_if_false_instruction(self, modes):
-        condition = self.get_arg(self.pop(), modes.pop(0, 0))
-        pointer = self.get_arg(self.pop(), modes.pop(1, 0))
+        condition = self.get_arg(self.pop(), modes[0])
+        pointer = self.get_arg(self.pop(), modes[1])
         if condition == 0:
             self.set_cursor(pointer)
 
     def less_then_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
-        output_position = self.output_position(self.pop(), modes.pop(2, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
+        output_position = self.output_position(self.pop(), modes[2])
         self.set_memory(output_position, int(left < right))
         return False
 
     def equals_instruction(self, modes):
-        left = self.get_arg(self.pop(), modes.pop(0, 0))
-        right = self.get_arg(self.pop(), modes.pop(1, 0))
-        output_position = self.output_position(self.pop(), modes.pop(2, 0))
+        left = self.get_arg(self.pop(), modes[0])
+        right = self.get_arg(self.pop(), modes[1])
+        output_position = self.output_position(self.pop(), modes[2])
         self.set_memory(output_position, int(left == right))
         return False
 
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+# Stands in for pages of `low` nothing was written to yet. Never owned, so
+# never written to itself.
+ZERO_PAGE = array('q', bytes(8 * PAGE_SIZE))
+
+# Memory made of fixed-size `array('q')` pages. A page that has to hold a value
+# outside of 64 bits is turned into a plain list. Pages from address 0 through
+# the program and a little past it are in a list, `low`, indexed by page
+# number, so the hottest reads index two sequences and never hash; pages far
+# past it are sparse, in a dict, `pages`, and allocated on first write.
+# Pages are shared copy-on-write between forks: a page is copied on the first
+# write into it unless this memory is its only owner, so a fork costs about
+# the pages it writes to.
+class PagedMemory():
+    def __init__(self, program=()):
+        super().__init__()
+        self.low = []
+        for start in range(0, len(program), PAGE_SIZE):
+            self.low.append(self.new_page(program[start:start + PAGE_SIZE]))
+        self.pages = {}
+        self.owned = set(range(len(self.low)))
+
+    @staticmethod
+    def new_page(values):
+        # A copy of `values`, which may be shorter than a page, like the last
+        # one of a program
+        try:
+            page = array('q', values)
+        except OverflowError:
+            page = list(values)
+        if len(page) < PAGE_SIZE:
+            page.extend([0] * (PAGE_SIZE - len(page)))
+        return page
+
+    def fork(self):
+        self.owned.clear()
+        memory = PagedMemory()
+        memory.low = list(self.low)
+        memory.pages = dict(self.pages)
+        return memory
+
+    def page(self, number):
+        if number < len(self.low):
+            return self.low[number]
+        return self.pages.get(number)
+
+    def chunks(self):
+        # (first address, cells) of every page
+        for number, page in enumerate(self.low):
+            yield number << PAGE_BITS, page
+        for number, page in self.pages.items():
+            yield number << PAGE_BITS, page
+
+    def differences(self, other):
+        # (address, value) of every cell that differs from `other`. Pages
+        # both still share can't differ, and aren't compared.
+        numbers = set(range(max(len(self.low), len(other.low))))
+        numbers.update(self.pages, other.pages)
+        for number in sorted(numbers):
+            page = self.page(number)
+            original = other.page(number)
+            if page is original:
+                continue
+            start = number << PAGE_BITS
+            cells = itertools.zip_longest(page or (), original or (), fillvalue=0)
+            for offset, (value, expected) in enumerate(cells):
+                if value != expected:
+                    yield start + offset, value
+
+    def __getitem__(self, position):
+        if position < 0:
+            raise Exception("Negative address: {}".format(position))
+        page = self.page(position >> PAGE_BITS)
+        if page is None or (position & PAGE_MASK) >= len(page):
+            # No such page, or past the end of the last one of a program image
+            return 0
+        return page[position & PAGE_MASK]
+
+    def __setitem__(self, position, val):
+        if position < 0:
+            raise Exception("Negative address: {}".format(position))
+        number = position >> PAGE_BITS
+        low = self.low
+        if len(low) <= number < 2 * len(low) + 2:
+            # Near enough to grow `low` up to it, taking in the pages on the way
+            low.extend(self.pages.pop(n, ZERO_PAGE) for n in range(len(low), number + 1))
+        if number in self.owned:
+            page = low[number] if number < len(low) else self.pages[number]
+        else:
+            page = self.page(number)
+            if page is None:
+                page = array('q', bytes(8 * PAGE_SIZE))
+            else:
+                # Shared page may also be a read-only view of a program image
+                page = self.new_page(page)
+            self.set_page(number, page)
+            self.owned.add(number)
+        try:
+            page[position & PAGE_MASK] = val
+        except OverflowError:
+            page = list(page)
+            self.set_page(number, page)
+            page[position & PAGE_MASK] = val
+
+    def set_page(self, number, page):
+        if number < len(self.low):
+            self.low[number] = page
+        else:
+            self.pages[number] = page
+
 class IntcodeV3(Jumper):
+    # Bump when a change makes the same program give different results, as
+    # cached results are keyed by it
+    version = 1
+
     def __init__(self, memory):
         super().__init__(memory)
-        self.memory = defaultdict(
-            lambda : 0,
-            {i: v for i, v in enumerate(self.memory)}
-        )
+        if not isinstance(self.memory, PagedMemory):
+            self.memory = PagedMemory(self.memory)
+        self._low = self.memory.low
+        self._owned = self.memory.owned
         self.relative_base = 0
         self.instructions.update({
             9: self.adjust_base_instruction
         })
 
+    # `get`, `pop` and `set_memory` index the pages of `low` directly, and
+    # only go through `PagedMemory` past them, to raise on negative addresses,
+    # or to copy a shared page, since they are the hottest path
+    def get(self, position):
+        if position >= 0:
+            try:
+                return self._low[position >> PAGE_BITS][position & PAGE_MASK]
+            except IndexError:
+                pass
+        return self.memory[position]
+
+    def pop(self):
+        cursor = self.cursor
+        self.cursor = cursor + 1
+        if cursor >= 0:
+            try:
+                return self._low[cursor >> PAGE_BITS][cursor & PAGE_MASK]
+            except IndexError:
+                pass
+        return self.memory[cursor]
+
+    def set_memory(self, pos, val):
+        number = pos >> PAGE_BITS
+        if number in self._owned:
+            try:
+                self._low[number][pos & PAGE_MASK] = val
+            except (IndexError, OverflowError):
+                # A sparse page, or a value that needs the page turned into a list
+                self.memory[pos] = val
+        else:
+            self.memory[pos] = val
+        if pos in self._decoded:
+            # Self-modifying code rewrote an instruction we've already decoded
+            del self._decoded[pos]
+
+    def copy_memory(self, memory):
+        return memory.fork()
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['relative_base'] = self.relative_base
+        return snapshot
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        self._low = self.memory.low
+        self._owned = self.memory.owned
+        self.relative_base = snapshot['relative_base']
+
     def adjust_base_instruction(self, modes):
-        self.relative_base += self.get_arg(self.pop(), modes.pop(0, 0))
+        self.relative_base += self.get_arg(self.pop(), modes[0])
         return False
 
     def get_arg(self, arg, mode):
@@ -166,13 +465,33 @@ class IntcodeV3(Jumper):
             return self.relative_base + arg
         return super().output_position(arg, mode)
 
-def part1(program):
+def run_many(program, inputs, workers=None, engine=IntcodeV3):
+    # Runs `program` once per input on a thread pool, returns the outputs in
+    # order. Machines share the program and copy it on write. Threads
+    # only run at once on free-threaded builds, with the GIL this is as fast
+    # as a loop at best.
+    base = PagedMemory(program)
+    machines = [engine(base.fork()) for _ in inputs]
+
+    def run(machine, input):
+        machine.run(input)
+        return machine.get_output()
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(run, machines, inputs))
+
+
+def part1(program, cache=None):
+    if cache is not None:
+        return cache.run(program, [1])
     computer = IntcodeV3(program)
     computer.run([1])
     return computer.get_output()
 
 
-def part2(program):
+def part2(program, cache=None):
+    if cache is not None:
+        return cache.run(program, [2])
     computer = IntcodeV3(program)
     computer.run([2])
     return computer.get_output()
@@ -0,0 +1,109 @@
+import json
+import time
+from collections import Counter
+
+HOOKS = ('run', 'tick', 'get', 'set_memory')
+
+
+# Counts what a machine does: instructions by opcode and by address, memory
+# reads and writes and wall time of every run.
+#
+# Hooks are set as attributes of the machine itself, wrapping whatever it had,
+# so machines that aren't profiled run exactly the same code as before, and
+# hooks of a `CycleDetector` attached first keep running. Every
+# instruction a superinstruction of `OptimizedIntcodeV3` stands for is counted.
+# Compiled blocks of `CompiledIntcodeV3` bypass `tick`, so only their reads and
+# writes are seen.
+class Profiler():
+    def __init__(self, machine):
+        super().__init__()
+        self.machine = machine
+        # (opcode, address) -> times executed
+        self.sites = Counter()
+        self.reads = Counter()
+        self.writes = Counter()
+        self.runs = []
+        self.shadowed = {name: machine.__dict__[name] for name in HOOKS if name in machine.__dict__}
+        for name in HOOKS:
+            setattr(self, '_' + name, getattr(machine, name))
+            setattr(machine, name, getattr(self, name))
+
+    def detach(self):
+        for name in HOOKS:
+            if name in self.shadowed:
+                setattr(self.machine, name, self.shadowed[name])
+            else:
+                del self.machine.__dict__[name]
+
+    def run(self, input=None):
+        start = time.perf_counter()
+        try:
+            return self._run(input)
+        finally:
+            self.runs.append(time.perf_counter() - start)
+
+    def tick(self):
+        machine = self.machine
+        address = machine.cursor
+        decoded = machine._decoded.get(address)
+        if decoded is None or decoded[0] is not None:
+            self.sites[self._get(address) % 100, address] += 1
+            return self._tick()
+        res = self._tick()
+        # A superinstruction, which is dropped if it wrote into itself, and
+        # then left right after that write
+        cut = address not in machine._decoded
+        for op, site in decoded[2]:
+            if cut and site >= machine.cursor:
+                break
+            self.sites[op, site] += 1
+        return res
+
+    def get(self, position):
+        self.reads[position] += 1
+        return self._get(position)
+
+    def set_memory(self, pos, val):
+        self.writes[pos] += 1
+        return self._set_memory(pos, val)
+
+    def opcode_name(self, op):
+        handler = self.machine.instructions.get(op)
+        return handler.__name__ if handler is not None else "unknown_{}".format(op)
+
+    def opcodes(self):
+        counts = Counter()
+        for (op, _), count in self.sites.items():
+            counts[op] += count
+        return counts
+
+    def addresses(self):
+        counts = Counter()
+        for (_, address), count in self.sites.items():
+            counts[address] += count
+        return counts
+
+    def report(self):
+        return {
+            'opcodes': {self.opcode_name(op): count for op, count in self.opcodes().most_common()},
+            'addresses': {address: count for address, count in self.addresses().most_common()},
+            'reads': dict(self.reads),
+            'writes': dict(self.writes),
+            'footprint': {'read': len(self.reads), 'written': len(self.writes)},
+            'runs': self.runs,
+        }
+
+    def to_json(self):
+        return json.dumps(self.report())
+
+    def folded(self):
+        # One line per instruction address, in the folded stacks format of flame graph tools
+        machine = type(self.machine).__name__
+        return "".join(
+            "{};{};@{} {}\n".format(machine, self.opcode_name(op), address, count)
+            for (op, address), count in sorted(self.sites.items())
+        )
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            f.write(self.folded())
@@ -1,21 +1,381 @@
+import os
+import shutil
+import tempfile
 import unittest
+from collections import deque
 import main
+import compiler
+import batch
+import profiler
+import image
+import analysis
+import checkpoint
+import cycles
+import cache
 
 class TestCase(unittest.TestCase):
+    engine = main.IntcodeV3
+
     def test_quine(self):
         program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
-        computer = main.IntcodeV3(program[:])
+        computer = self.engine(program[:])
         computer.run([])
         self.assertEqual(program, computer.get_output())
 
     def test_big_number(self):
         program = [1102,34915192,34915192,7,4,7,99,0]
-        computer = main.IntcodeV3(program[:])
+        computer = self.engine(program[:])
         computer.run([])
         self.assertEqual(len(str(computer.get_output()[-1])), 16)
 
     def test_big_number_in_the_middle(self):
         program = [104,1125899906842624,99]
-        computer = main.IntcodeV3(program[:])
+        computer = self.engine(program[:])
         computer.run([])
         self.assertEqual(computer.get_output()[-1], 1125899906842624)
+
+    def test_self_modifying(self):
+        # Outputs 1, overwrites the first instruction with 99 and jumps back to it
+        program = [104,1,1101,99,0,0,1106,0,0]
+        computer = self.engine(program[:])
+        computer.run([])
+        self.assertEqual(computer.get_output(), [1])
+
+    def test_huge_number_far_away(self):
+        # Squares 2**40 into a sparse high address and prints it back
+        program = [1102,1099511627776,1099511627776,1000000,4,1000000,99]
+        computer = self.engine(program[:])
+        computer.run([])
+        self.assertEqual(computer.get_output(), [2 ** 80])
+
+    def test_fork(self):
+        # Doubles its input
+        program = [3,9,102,2,9,10,4,10,99,0,0]
+        computer = self.engine(program[:])
+        snapshot = computer.snapshot()
+        fork = computer.fork()
+        fork.run([21])
+        computer.run([5])
+        self.assertEqual(fork.get_output(), [42])
+        self.assertEqual(computer.get_output(), [10])
+        computer.restore(snapshot)
+        computer.run([6])
+        self.assertEqual(computer.get_output(), [12])
+
+    def test_fork_copies_written_pages_only(self):
+        # Stores its input in the third page of the program
+        program = [3,2500,99] + [0] * 3000
+        computer = self.engine(program[:])
+        fork = computer.fork()
+        fork.run([7])
+        shared = [page is original for (_, page), (_, original) in zip(fork.memory.chunks(), computer.memory.chunks())]
+        self.assertEqual(shared, [True, True, False])
+        self.assertEqual((fork.get(2500), computer.get(2500)), (7, 0))
+
+    def test_negative_address(self):
+        # Prints the cell at -1
+        computer = self.engine([4,-1,99])
+        with self.assertRaisesRegex(Exception, "Negative address"):
+            computer.run([])
+
+    def test_stream(self):
+        # Doubles every input, forever
+        program = [3,11,102,2,11,12,4,12,1105,1,0,0,0]
+        computer = self.engine(program[:])
+        queue = deque([1, 2])
+        stream = computer.stream(queue)
+        self.assertEqual([next(stream), next(stream)], [2, 4])
+        self.assertIs(next(stream), main.STARVED)
+        queue.append(5)
+        self.assertEqual(next(stream), 10)
+        self.assertIs(next(stream), main.STARVED)
+        self.assertEqual(stream.send(7), 14)
+
+    def test_stream_halts(self):
+        program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        computer = self.engine(program[:])
+        self.assertEqual(list(computer.stream()), program)
+
+    def test_stream_earlier_output(self):
+        # Prints 7, then echoes its input
+        program = [104,7,3,9,4,9,99,0,0,0]
+        computer = self.engine(program[:])
+        computer.tick()
+        self.assertEqual(list(computer.stream([5])), [7, 5])
+
+    def test_fork_streamed(self):
+        # Prints its first input, then 10 times the third plus the second
+        program = [3,19,4,19,3,20,3,21,1002,21,10,21,1,20,21,22,4,22,99,0,0,0,0]
+        computer = self.engine(program[:])
+        stream = computer.stream([1, 2, 3])
+        self.assertEqual(next(stream), 1)
+        fork = computer.fork()
+        fork.run()
+        self.assertEqual(fork.get_output(), [32])
+        self.assertEqual(list(stream), [32])
+
+class EagerCompiledIntcodeV3(compiler.CompiledIntcodeV3):
+    # Compiles every block right away, so that the tests go through compiled code
+    hot_entries = 1
+
+class CompiledTestCase(TestCase):
+    engine = EagerCompiledIntcodeV3
+
+    def test_resume_after_missing_input(self):
+        # Prints 1, then prints its input
+        program = [104,1,3,9,4,9,99,0,0,0]
+        computer = self.engine(program[:])
+        with self.assertRaises(IndexError):
+            computer.run([])
+        self.assertEqual((computer.cursor, computer.get_output()), (2, [1]))
+        computer.run([5])
+        self.assertEqual(computer.get_output(), [1, 5])
+
+class OptimizedTestCase(TestCase):
+    engine = analysis.OptimizedIntcodeV3
+
+    def test_counter_loop(self):
+        # Counts up to its input
+        program = [3,30,1001,31,1,31,7,31,30,32,1005,32,2,4,31,99] + [0] * 17
+        computer = self.engine(program[:])
+        self.assertEqual(computer.report, [{'pattern': 'counter_loop', 'start': 2, 'end': 13, 'proven': True}])
+        computer.run([7])
+        self.assertEqual(computer.get_output(), [7])
+
+    def test_write_into_superinstruction(self):
+        # Counts to 5, but first rewrites the limit to 9 through the relative base
+        program = [109,12,21101,9,0,0,1001,31,1,31,1007,31,5,32,1005,32,6,4,31,99] + [0] * 13
+        computer = self.engine(program[:])
+        self.assertEqual(computer.report, [{'pattern': 'counter_loop', 'start': 6, 'end': 17, 'proven': False}])
+        computer.run([])
+        self.assertEqual(computer.get_output(), [9])
+
+class ProfilerTestCase(unittest.TestCase):
+    def test_profile(self):
+        program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        computer = main.IntcodeV3(program[:])
+        profile = profiler.Profiler(computer)
+        computer.run([])
+        report = profile.report()
+        self.assertEqual(report['opcodes']['output_instruction'], 16)
+        self.assertEqual(report['opcodes']['exit_instruction'], 1)
+        self.assertEqual(report['addresses'][2], 16)
+        self.assertEqual(report['footprint']['written'], 2)
+        self.assertEqual(len(report['runs']), 1)
+        self.assertIn("IntcodeV3;output_instruction;@2 16\n", profile.folded())
+        profile.detach()
+        self.assertNotIn('tick', vars(computer))
+
+    def test_profile_optimized(self):
+        # Counts up to its input
+        program = [3,30,1001,31,1,31,7,31,30,32,1005,32,2,4,31,99] + [0] * 17
+        profiles = []
+        for engine in (main.IntcodeV3, analysis.OptimizedIntcodeV3, EagerCompiledIntcodeV3):
+            computer = engine(program[:])
+            profiles.append(profiler.Profiler(computer))
+            computer.run([7])
+        plain, optimized, compiled = profiles
+        self.assertEqual(optimized.sites, plain.sites)
+        for profile in (optimized, compiled):
+            self.assertEqual(profile.reads, plain.reads)
+            self.assertEqual(profile.writes, plain.writes)
+
+class ImageTestCase(unittest.TestCase):
+    def load(self, program):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        image.write(program, path)
+        return image.ProgramImage(path)
+
+    def test_round_trip(self):
+        program = [104,2 ** 70,1102,-3,5,10,4,10,99] + [7] * 2000
+        self.assertEqual(self.load(program).to_list(), program)
+
+    def test_machines_share_image(self):
+        program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        loaded = self.load(program)
+        for _ in range(2):
+            computer = main.IntcodeV3(loaded.memory())
+            computer.run([])
+            self.assertEqual(computer.get_output(), program)
+        self.assertEqual(loaded.to_list(), program)
+
+    def test_write_copies_one_page(self):
+        # Stores its input in the second page of the program, and prints it
+        program = [3,1500,4,1500,99] + [0] * 2000 + [2 ** 70]
+        loaded = self.load(program)
+        computer = main.IntcodeV3(loaded.memory())
+        computer.run([7])
+        self.assertEqual(computer.get_output(), [7])
+        self.assertEqual([page is original for page, original in zip(computer.memory.low, loaded.pages)], [True, False])
+        self.assertEqual((computer.get(2005), computer.get(2006)), (2 ** 70, 0))
+        self.assertEqual(loaded.to_list(), program)
+
+class CheckpointTestCase(unittest.TestCase):
+    def checkpointer(self, program, every=100000):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        return checkpoint.Checkpointer(program, path, every)
+
+    def test_resume(self):
+        # Squares 2**40 into a sparse high address, prints it, then reads and doubles its input
+        program = [1102,1099511627776,1099511627776,1000000,4,1000000,3,15,102,2,15,16,4,16,99,0,0]
+        saved = self.checkpointer(program)
+        computer = main.IntcodeV3(program[:])
+        computer._input = [21]
+        for _ in range(2):
+            computer.tick()
+        saved.save(computer)
+        resumed = saved.resume()
+        self.assertEqual(resumed.get_output(), [2 ** 80, 42])
+        # Once the input is stored, within the program
+        computer.tick()
+        saved.save(computer)
+        self.assertEqual(saved.resume().get_output(), [2 ** 80, 42])
+        # A checkpoint of this program, loaded as one of another
+        other = self.checkpointer(program[:-1])
+        shutil.copyfile(saved.path, other.path)
+        with self.assertRaisesRegex(Exception, "another program"):
+            other.load()
+
+    def test_streamed(self):
+        program = [3,19,4,19,3,20,3,21,1002,21,10,21,1,20,21,22,4,22,99,0,0,0,0]
+        saved = self.checkpointer(program)
+        computer = main.IntcodeV3(program[:])
+        stream = computer.stream(deque([1, 2, 3]))
+        self.assertEqual(next(stream), 1)
+        saved.save(computer)
+        self.assertEqual(saved.resume().get_output(), [32])
+
+    def test_auto_checkpoint(self):
+        program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        saved = self.checkpointer(program, every=7)
+        computer = main.IntcodeV3(program[:])
+        saved.run(computer, [])
+        self.assertEqual(saved.load().get_output(), program)
+
+class CycleTestCase(unittest.TestCase):
+    def test_infinite_loop(self):
+        # Counts to 100, then jumps to itself forever
+        program = [1001,20,1,20,1007,20,100,21,1005,21,0,109,1,109,-1,1105,1,11] + [0] * 4
+        computer = main.IntcodeV3(program[:])
+        cycles.CycleDetector(computer)
+        with self.assertRaises(cycles.CycleDetected) as caught:
+            computer.run([])
+        self.assertEqual((caught.exception.address, caught.exception.period), (11, 3))
+
+    def test_infinite_loop_compiled(self):
+        program = [1001,20,1,20,1007,20,100,21,1005,21,0,109,1,109,-1,1105,1,11] + [0] * 4
+        computer = EagerCompiledIntcodeV3(program[:])
+        detector = cycles.CycleDetector(computer)
+        with self.assertRaises(cycles.CycleDetected) as caught:
+            computer.run([])
+        # The loop is a single block, replayed instruction by instruction
+        self.assertEqual((caught.exception.address, caught.exception.period), (11, 3))
+        detector.detach()
+        self.assertEqual(vars(computer).keys() & set(detector.hooks), set())
+
+    def test_entry_inside_the_loop(self):
+        # Counts to 5, then jumps into the middle of a loop from 14 to 20, so
+        # the cycle starts at 16
+        program = [1001,30,1,30,1007,30,5,31,1005,31,0,1105,1,16,109,1,109,-1,1105,1,14] + [0] * 11
+        computer = main.IntcodeV3(program[:])
+        cycles.CycleDetector(computer)
+        with self.assertRaises(cycles.CycleDetected) as caught:
+            computer.run([])
+        self.assertEqual((caught.exception.address, caught.exception.period), (16, 3))
+
+    def test_profiled_after_detector(self):
+        program = [1001,20,1,20,1007,20,100,21,1005,21,0,109,1,109,-1,1105,1,11] + [0] * 4
+        computer = main.IntcodeV3(program[:])
+        detector = cycles.CycleDetector(computer)
+        profile = profiler.Profiler(computer)
+        with self.assertRaises(cycles.CycleDetected):
+            computer.run([])
+        self.assertEqual(profile.sites[5, 8], 100)
+        profile.detach()
+        self.assertEqual(computer.tick, detector.tick)
+        detector.detach()
+        self.assertEqual(vars(computer).keys() & set(detector.hooks), set())
+
+    def test_no_false_cycle(self):
+        program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        computer = main.IntcodeV3(program[:])
+        detector = cycles.CycleDetector(computer)
+        computer.run([])
+        self.assertEqual(computer.get_output(), program)
+        detector.detach()
+        self.assertNotIn('tick', vars(computer))
+
+class CacheTestCase(unittest.TestCase):
+    def test_cached_runs(self):
+        # Doubles its input
+        program = [3,9,102,2,9,10,4,10,99,0,0]
+        with tempfile.TemporaryDirectory() as directory:
+            results = cache.ResultCache(directory, size=2)
+            self.assertEqual(results.run(program, [21]), [42])
+            self.assertEqual(results.run(program, [21]), [42])
+            self.assertEqual((results.hits, results.misses), (1, 1))
+            self.assertEqual(results.run(program, [21], compiler.CompiledIntcodeV3), [42])
+            self.assertEqual(results.misses, 2)
+            # Evicts least recently used entries down to the low water mark,
+            # starting with the one run with IntcodeV3
+            results.run(program, [5])
+            self.assertEqual(os.listdir(directory), [results.key(program, main.IntcodeV3, [5]) + '.json'])
+            self.assertIsNone(results.get(results.key(program, main.IntcodeV3, [21])))
+            self.assertEqual(main.part1(program + [0] * 1000, results), main.part1(program + [0] * 1000))
+
+    def test_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Left by a writer that died long ago, and one still writing
+            stale = os.path.join(directory, 'stale.tmp')
+            fresh = os.path.join(directory, 'fresh.tmp')
+            for path in (stale, fresh):
+                open(path, 'w').close()
+            os.utime(stale, (0, 0))
+            results = cache.ResultCache(directory, size=10)
+            for i in range(10):
+                results.put(str(i), [i])
+            self.assertEqual(results.count, 10)
+            self.assertTrue(os.path.exists(stale))
+            # Putting an existing key again doesn't add an entry
+            results.put('0', [0])
+            self.assertEqual(results.count, 10)
+            # One too many evicts down to the low water mark
+            results.put('10', [10])
+            self.assertEqual(results.count, 9)
+            self.assertEqual(sorted(os.listdir(directory)), sorted(['fresh.tmp'] + ['{}.json'.format(i) for i in [0] + list(range(3, 11))]))
+            # Entries of other processes are counted once evicting
+            results = cache.ResultCache(directory, size=10)
+            self.assertEqual(results.count, 9)
+            # Evicted by another process between reading and touching
+            results.touch(os.path.join(directory, 'missing.json'))
+
+class BatchTestCase(unittest.TestCase):
+    def assertSameAsSeparate(self, program, inputs):
+        expected = []
+        for input in inputs:
+            computer = main.IntcodeV3(program[:])
+            computer.run(input[:])
+            expected.append(computer.get_output())
+        self.assertEqual(batch.run_batch(program, [input[:] for input in inputs]), expected)
+        self.assertEqual(main.run_many(program, [input[:] for input in inputs], workers=4), expected)
+
+    def test_counting_down(self):
+        # Counts its input down to zero and prints how many loops are left, i.e. 0
+        program = [3,20,1001,20,-1,20,1005,20,2,4,20,99]
+        self.assertSameAsSeparate(program, [[i] for i in range(1, 50)])
+
+    def test_peeled_machines(self):
+        # Quine, values out of int64 and far away addresses all run on the scalar interpreter
+        program = [1102,1099511627776,1099511627776,1000000,4,1000000,99]
+        self.assertSameAsSeparate(program, [[], []])
+        program = [109,1,204,-1,1001,100,1,100,1008,100,16,101,1006,101,0,99]
+        self.assertSameAsSeparate(program, [[], []])
+
+    def test_diverging(self):
+        # Doubles input if it is less than 5, squares it otherwise
+        program = [3,23,1007,23,5,24,1005,24,16,2,23,23,23,1105,1,20,1002,23,2,23,4,23,99,0,0]
+        self.assertSameAsSeparate(program, [[i] for i in range(-3, 10)])